@@ -1,109 +1,217 @@
 from app.tools import run_tool
-from app.llm import generate_reply
+from app.llm import generate_reply, stream_reply
 from app.memory import store
+import asyncio
+import os
 import re
 
 
-def handle_message(text: str, session_id: str):
+_WS_RE = re.compile(r"\s+")
+# Substrings that mean msg needs whitespace normalization; most chat input has none
+_WS_RUNS = ("  ", "\t", "\n", "\r")
+# Routing only looks at the leading words (longest route is "what's my plan"),
+# so only this much of the message is lowercased per turn.
+_HEAD_LEN = 24
+# One anchored alternation for the regex-parsed commands; msg_norm is already
+# stripped with single spaces, so a single match decides the command.
+_CMD_RE = re.compile(
+    r"^(?:"
+    r"(?P<rem_timed>remind\s+me\s+in\s+(?P<minutes>[+-]?\d+)\s+minutes?\s+to\s+(?P<timed_text>.+))"
+    r"|(?P<rem_plain>remind\s+me\s+to\s+(?P<plain_text>.+))"
+    r"|(?P<comp_rem>complete\s+reminder\s+(?P<reminder_id>\S+))"
+    r"|(?P<comp_task>complete\s+(?P<task_id>\S+))"
+    r")$",
+    re.IGNORECASE,
+)
+_KV_RE = re.compile(r"(\w+)=(\S+)")
+# Prior messages loaded for the LLM; llm.py further trims them to a token budget
+_HISTORY_LIMIT = int(os.getenv("LLM_HISTORY_LIMIT", "12"))
+
+
+# -------- Command handlers --------
+# Each handler receives the original text, the whitespace-normalized text and
+# the lowercased leading tokens (taken from the first _HEAD_LEN characters).
+# Returning None falls through to the LLM.
+
+# Length of the routed prefix ("add task ", "todo ", "remember to "), by first token
+_ADD_TASK_PREFIX_LEN = {"add": len("add task "), "todo": len("todo "), "remember": len("remember to ")}
+
+
+def _cmd_add_task(text: str, msg_norm: str, tokens: list, session_id: str):
+    title = msg_norm[_ADD_TASK_PREFIX_LEN[tokens[0]]:]
+    if not title:
+        return None
+    run_tool("add_task", session_id, {"title": title})
+    return f"Task added: {title}"
+
+
+def _remind_timed(m, session_id: str):
+    # Timed: "remind me in N minutes to X" (N may be negative)
+    minutes = int(m.group("minutes"))
+    text_after = m.group("timed_text").strip(" .!?")
+    run_tool("add_reminder", session_id, {"text": text_after, "minutes": minutes})
+    return f"Reminder set in {minutes} minutes: {text_after}"
+
+
+def _remind_plain(m, session_id: str):
+    # Untimed: "remind me to X"
+    text_after = m.group("plain_text").strip(" .!?")
+    run_tool("add_reminder", session_id, {"text": text_after})
+    return f"Reminder set: {text_after}"
+
+
+def _complete_reminder(m, session_id: str):
+    res = run_tool("complete_reminder", session_id, {"reminder_id": m.group("reminder_id")})
+    return "Reminder completed." if res.get("ok") else "Reminder not found."
+
+
+def _complete_task(m, session_id: str):
+    task_id = m.group("task_id")
+    # "complete reminder" without an id is not a task id
+    if task_id.lower() == "reminder":
+        return None
+    result = run_tool("complete_task", session_id, {"task_id": task_id})
+    return "Task completed." if result.get("ok") else "Task not found."
+
+
+_PATTERN_HANDLERS = {
+    "rem_timed": _remind_timed,
+    "rem_plain": _remind_plain,
+    "comp_rem": _complete_reminder,
+    "comp_task": _complete_task,
+}
+
+
+def _cmd_pattern(text: str, msg_norm: str, tokens: list, session_id: str):
+    m = _CMD_RE.match(msg_norm)
+    if not m:
+        return None
+    return _PATTERN_HANDLERS[m.lastgroup](m, session_id)
+
+
+def _cmd_list_reminders(text: str, msg_norm: str, tokens: list, session_id: str):
+    return "\n".join(store.list_reminder_lines(session_id)) or "You have no reminders."
+
+
+def _as_int(value, default: int) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _cmd_check_in(text: str, msg_norm: str, tokens: list, session_id: str):
+    # CHECK-IN: "check in: mood=happy energy=7 focus=6 note=Did stuff"
+    # accept both 'check in:' and 'check in '
+    rest = text.split("check in", 1)[-1].strip(" :")
+    kv = {k.lower(): v for k, v in _KV_RE.findall(rest)}
+    mood = kv.get("mood", "ok")
+    energy = _as_int(kv.get("energy"), 5)
+    focus = _as_int(kv.get("focus"), 5)
+    note = kv.get("note", "")
+    res = run_tool("check_in", session_id, {"mood": mood, "energy": energy, "focus": focus, "note": note})
+    return "Check-in recorded." if res.get("ok") else "Failed to record check-in."
+
+
+_DASHBOARD_PHRASES = ("today", "dashboard", "what's my plan", "whats my plan")
+
+
+def _cmd_today(text: str, msg_norm: str, tokens: list, session_id: str):
+    if msg_norm.lower() not in _DASHBOARD_PHRASES:
+        return None
+    res = run_tool("today_summary", session_id, {})
+    last = res.get("last_checkin")
+    last_s = f"last check-in mood={last['mood']} energy={last['energy']}" if last else "no recent check-in"
+    return f"Open tasks: {res.get('open_tasks')} | Open reminders: {res.get('open_reminders')} | {last_s}"
+
+
+def _cmd_list_tasks(text: str, msg_norm: str, tokens: list, session_id: str):
+    return "\n".join(store.list_task_lines(session_id)) or "You have no tasks."
+
+
+# -------- Router --------
+# Prefix trie over the lowercased leading tokens. Inner nodes are dicts, leaves
+# are handlers; "*" matches any token not listed explicitly at that level.
+ROUTER = {
+    "add": {"task": _cmd_add_task},
+    "todo": _cmd_add_task,
+    "remember": {"to": _cmd_add_task},
+    "remind": {"me": _cmd_pattern},
+    "list": {"tasks": _cmd_list_tasks, "reminders": _cmd_list_reminders},
+    "my": {"tasks": _cmd_list_tasks, "reminders": _cmd_list_reminders},
+    "complete": _cmd_pattern,
+    "check": {"in": _cmd_check_in, "in:": _cmd_check_in},
+    "today": _cmd_today,
+    "dashboard": _cmd_today,
+    "what's": {"my": {"plan": _cmd_today}},
+    "whats": {"my": {"plan": _cmd_today}},
+}
+
+
+def _route(tokens: list):
+    """Walk ROUTER token by token and return the matching handler or None."""
+    node = ROUTER
+    for tok in tokens:
+        nxt = node.get(tok)
+        if nxt is None and ":" in tok:
+            # "check in:mood=ok" -- route on the "in:" part of the glued token
+            nxt = node.get(tok[: tok.index(":") + 1])
+        if nxt is None:
+            nxt = node.get("*")
+        if nxt is None:
+            return None
+        if callable(nxt):
+            return nxt
+        node = nxt
+    return None
+
+
+def _route_or_history(text: str, session_id: str):
+    """Answer a routed command, or load the LLM history; returns (reply, history)."""
     msg = text.strip()
     # normalize internal spacing for robust parsing (but preserve original `text`/`msg` for outputs)
-    msg_norm = re.sub(r"\s+", " ", msg)
-    lower = msg_norm.lower()
-
-    # ADD TASK
-    if lower.startswith(("add task", "todo", "remember to")):
-        title = text.split(" ", 2)[-1] if lower.startswith("add task") else text.split(" ", 1)[-1]
-        result = run_tool("add_task", session_id, {"title": title})
-        return f"Task added: {title}"
-
-    # REMINDERS: regex-based parsing for robustness
-    if lower.startswith("remind me"):
-        # Timed: "remind me in N minutes to X" (N may be negative)
-        m = re.match(r"^\s*remind\s+me\s+in\s+([+-]?\d+)\s+minutes?\s+to\s+(.+?)\s*$", msg_norm, re.IGNORECASE)
-        if m:
-            try:
-                minutes = int(m.group(1))
-                text_after = m.group(2).strip(" .!?")
-                result = run_tool("add_reminder", session_id, {"text": text_after, "minutes": minutes})
-                return f"Reminder set in {minutes} minutes: {text_after}"
-            except Exception:
-                pass
-
-        # Untimed: "remind me to X"
-        m2 = re.match(r"^\s*remind\s+me\s+to\s+(.+?)\s*$", msg_norm, re.IGNORECASE)
-        if m2:
-            text_after = m2.group(1).strip(" .!?")
-            result = run_tool("add_reminder", session_id, {"text": text_after})
-            return f"Reminder set: {text_after}"
-
-    # LIST REMINDERS
-    if "list reminders" in lower or "my reminders" in lower:
-        res = run_tool("list_reminders", session_id, {})
-        if not res.get("reminders"):
-            return "You have no reminders."
-        return "\n".join([f"{r['id']} | {'✓' if r['completed'] else '•'} {r['text']} (due {r['due_ts']})" for r in res["reminders"]])
-
-    # COMPLETE REMINDER (explicit)
-    m_rem = re.match(r"^\s*complete\s+reminder\s+(\S+)\s*$", msg_norm, re.IGNORECASE)
-    if m_rem:
-        rid = m_rem.group(1)
-        res = run_tool("complete_reminder", session_id, {"reminder_id": rid})
-        return "Reminder completed." if res.get("ok") else "Reminder not found."
+    msg_norm = _WS_RE.sub(" ", msg) if any(ws in msg for ws in _WS_RUNS) else msg
+    tokens = msg_norm[:_HEAD_LEN].lower().split(None, 3)
 
-    # CHECK-IN: "check in: mood=happy energy=7 focus=6 note=Did stuff"
-    if lower.startswith("check in"):
-        # accept both 'check in:' and 'check in '
-        # attempt key=value parsing
-        rest = text.split("check in", 1)[-1].strip(" :")
-        parts = [p.strip() for p in rest.split() if p.strip()]
-        kv = {}
-        for p in parts:
-            if "=" in p:
-                k, v = p.split("=", 1)
-                kv[k.strip().lower()] = v.strip()
-        mood = kv.get("mood", "ok")
-        energy = int(kv.get("energy", 5))
-        focus = int(kv.get("focus", 5))
-        note = kv.get("note", "")
-        res = run_tool("check_in", session_id, {"mood": mood, "energy": energy, "focus": focus, "note": note})
-        return "Check-in recorded." if res.get("ok") else "Failed to record check-in."
-
-    # DASHBOARD / TODAY
-    if lower in ("today", "dashboard", "what's my plan", "whats my plan"):
-        res = run_tool("today_summary", session_id, {})
-        last = res.get("last_checkin")
-        last_s = f"last check-in mood={last['mood']} energy={last['energy']}" if last else "no recent check-in"
-        return f"Open tasks: {res.get('open_tasks')} | Open reminders: {res.get('open_reminders')} | {last_s}"
-
-    # LIST TASKS
-    if "list tasks" in lower or "my tasks" in lower:
-        result = run_tool("list_tasks", session_id, {})
-        if not result["tasks"]:
-            return "You have no tasks."
-        return "\n".join(
-            [f"{t['id']} | {'✓' if t['completed'] else '•'} {t['title']}" for t in result["tasks"]]
-        )
-
-    # COMPLETE TASK (but not 'complete reminder')
-    m_task = re.match(r"^\s*complete\s+(\S+)\s*$", text, re.IGNORECASE)
-    if m_task:
-        task_id = m_task.group(1)
-        # ensure this wasn't the 'complete reminder' case already handled
-        if not re.match(r"^reminder$", task_id, re.IGNORECASE):
-            result = run_tool("complete_task", session_id, {"task_id": task_id})
-            return "Task completed." if result.get("ok") else "Task not found."
-
-    # FALLBACK: LLM
-    history = [{"role": m["role"], "content": m["content"]}
-               for m in store.get_history(session_id, limit=12)]
-
-    return generate_reply(text, session_id=session_id, history=history)
-
-
-def handle_inbound(text: str, session_id: str, source: str = "discord") -> str:
+    # one DB session/commit for the whole turn; released before the LLM call
+    with store.unit_of_work():
+        handler = _route(tokens)
+        if handler is not None:
+            reply = handler(text, msg_norm, tokens, session_id)
+            if reply is not None:
+                return reply, None
+
+        # FALLBACK: LLM
+        history = [{"role": m["role"], "content": m["content"]}
+                   for m in store.get_history(session_id, limit=_HISTORY_LIMIT)]
+    return None, history
+
+
+async def handle_message(text: str, session_id: str):
+    # routing and history are sync DB work; keep them off the event loop
+    reply, history = await asyncio.to_thread(_route_or_history, text, session_id)
+    if reply is not None:
+        return reply
+    return await generate_reply(text, session_id=session_id, history=history)
+
+
+async def stream_message(text: str, session_id: str):
+    """Like `handle_message`, but yield the reply in chunks as the LLM streams it.
+
+    Command replies are yielded whole.
+    """
+    reply, history = await asyncio.to_thread(_route_or_history, text, session_id)
+    if reply is not None:
+        yield reply
+        return
+    async for delta in stream_reply(text, session_id=session_id, history=history):
+        yield delta
+
+
+async def handle_inbound(text: str, session_id: str, source: str = "discord") -> str:
     """Handle inbound messages from external channels.
 
     This delegates to `handle_message` for now but provides a seam for
     future channel-specific behavior (different prompts, routing, etc.).
     """
-    return handle_message(text, session_id)
+    return await handle_message(text, session_id)
@@ -1,10 +1,17 @@
 # app/db_store.py
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
 from datetime import datetime, timezone, timedelta
-from typing import List, Optional
+from secrets import token_hex
+from typing import Any, Iterator, List, Optional
+import threading
+import time
 from sqlalchemy.orm import Session as DBSession
-from sqlalchemy import desc
-import uuid
+from sqlalchemy import desc, func, insert, literal, select, text, true, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 
+from app import outbox_events
 from app.models import (
     get_session_factory,
     Session,
@@ -16,312 +23,566 @@ from app.models import (
     InboundMessage,
 )
 
+# DB session shared by every store call inside `DatabaseStore.unit_of_work()`
+_current_db: ContextVar[Optional[DBSession]] = ContextVar("current_db", default=None)
+
+_MISSING = object()
+
+# Wipe a session in one round-trip: PostgreSQL runs every data-modifying CTE
+# whether or not it is referenced. The child deletes don't rely on the
+# ON DELETE CASCADE FKs, which a database not re-run through init_db() lacks.
+_CLEAR_SESSION_SQL = text(
+    "WITH "
+    + ", ".join(
+        f"d_{t} AS (DELETE FROM {t} WHERE session_id = :sid)"
+        for t in (
+            Message.__tablename__,
+            Task.__tablename__,
+            Reminder.__tablename__,
+            CheckIn.__tablename__,
+            OutboundMessage.__tablename__,
+            InboundMessage.__tablename__,
+        )
+    )
+    + f" DELETE FROM {Session.__tablename__} WHERE id = :sid"
+)
+
+
+def _db_utc(dt: datetime) -> datetime:
+    """Naive UTC, the form the (timezone-less) DateTime columns hold"""
+    return dt.astimezone(timezone.utc).replace(tzinfo=None) if dt.tzinfo else dt
+
+
+def _new_id() -> str:
+    """Random 32-char hex row id; skips building and dash-formatting a UUID"""
+    return token_hex(16)
+
+
+class _LRUCache:
+    """Small thread-safe LRU cache with an optional per-entry TTL (seconds)"""
+
+    def __init__(self, maxsize: int, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Any, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                return default
+            expires, value = item
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value) -> None:
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def replace(self, key, fn) -> None:
+        """Set key to fn(current value), keeping its expiry; no-op if absent or expired"""
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                return
+            expires, value = item
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                return
+            self._data[key] = (expires, fn(value))
+
+    def pop(self, key) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
 
 class DatabaseStore:
     """PostgreSQL-backed session store (replaces InMemorySessionStore)"""
 
     def __init__(self):
         self.SessionFactory = get_session_factory()
+        # Per-process read caches; the TTL bounds staleness across workers.
+        # History entries map session_id -> {limit: rows}.
+        self._history_cache = _LRUCache(maxsize=1024, ttl=60)
+        self._channel_cache = _LRUCache(maxsize=4096)
+        # (session_id, inbound_id) pairs known to be stored; only positive
+        # answers are cached, a miss still asks the DB
+        self._inbound_cache = _LRUCache(maxsize=4096)
+
+    @contextmanager
+    def unit_of_work(self) -> Iterator[None]:
+        """Run all store calls in the block on one DB session and one commit.
+
+        Nested calls join the outermost unit of work.
+        """
+        if _current_db.get() is not None:
+            yield
+            return
+        db = self.SessionFactory()
+        token = _current_db.set(db)
+        try:
+            yield
+            db.commit()
+            for fn in db.info.pop("after_commit", ()):
+                fn()
+        except Exception:
+            db.rollback()
+            # cached reads may have seen rows that were just rolled back
+            self._history_cache.clear()
+            self._channel_cache.clear()
+            raise
+        finally:
+            _current_db.reset(token)
+            db.close()
+
+    @contextmanager
+    def _get_db(self) -> Iterator[DBSession]:
+        """Get database session (context manager pattern)
+
+        Reuses the unit-of-work session when one is active.
+        """
+        db = _current_db.get()
+        if db is not None:
+            yield db
+            return
+        with self.SessionFactory() as db:
+            yield db
+
+    def _commit(self, db: DBSession) -> None:
+        """Commit, or only flush when a unit of work owns the transaction"""
+        if db is _current_db.get():
+            db.flush()
+        else:
+            db.commit()
 
-    def _get_db(self) -> DBSession:
-        """Get database session (context manager pattern)"""
-        return self.SessionFactory()
-
-    def _ensure_session(self, session_id: str):
-        """Ensure session exists in database"""
-        with self._get_db() as db:
-            session = db.query(Session).filter(Session.id == session_id).first()
-            if not session:
-                session = Session(id=session_id)
-                db.add(session)
-                db.commit()
+    def _after_commit(self, db: DBSession, fn) -> None:
+        """Run fn once db's transaction commits; right away outside a unit of work"""
+        if db is _current_db.get():
+            db.info.setdefault("after_commit", []).append(fn)
+        else:
+            fn()
+
+    def _ensure_session(self, db: DBSession, session_id: str) -> None:
+        """Ensure session exists, inside the caller's transaction"""
+        db.execute(pg_insert(Session).values(id=session_id).on_conflict_do_nothing())
+
+    def _touch_session(self, db: DBSession, session_id: str, now: datetime) -> None:
+        """Create the session if missing and bump last_activity, in one statement"""
+        stmt = pg_insert(Session).values(id=session_id, last_activity=now)
+        db.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[Session.id],
+                set_={"last_activity": stmt.excluded.last_activity},
+            )
+        )
 
     # -------- Chat History --------
     def get_history(self, session_id: str, limit: int = 12) -> List[dict]:
-        """Get recent messages"""
+        """Get recent messages.
+
+        The list may be the cached window itself; treat it as read-only.
+        """
+        cached = self._history_cache.get(session_id)
+        if cached is not None and limit in cached:
+            return cached[limit]
         with self._get_db() as db:
-            messages = (
-                db.query(Message)
-                .filter(Message.session_id == session_id)
+            rows = db.execute(
+                select(Message.role, Message.content, Message.ts)
+                .where(Message.session_id == session_id)
                 .order_by(desc(Message.ts))
                 .limit(limit)
-                .all()
-            )
+            ).all()
             # Return in chronological order
-            return [
-                {"role": m.role, "content": m.content, "ts": m.ts.isoformat()}
-                for m in reversed(messages)
+            history = [
+                {"role": role, "content": content, "ts": ts.isoformat()}
+                for role, content, ts in reversed(rows)
             ]
-
-    def append(self, session_id: str, role: str, content: str) -> None:
-        """Append message to history"""
-        self._ensure_session(session_id)
+        entry = dict(cached or {})
+        entry[limit] = history
+        self._history_cache.set(session_id, entry)
+        return history
+
+    def _extend_history(self, session_id: str, rows: List[dict]) -> None:
+        """Add just-written rows to the cached windows so the next turn skips the SELECT"""
+        # keeps the entry's TTL, so rows written by other workers still show up
+        self._history_cache.replace(
+            session_id,
+            lambda cached: {limit: (window + rows)[-limit:] for limit, window in cached.items()},
+        )
+
+    def append(self, session_id: str, role: str, content: str, ts: Optional[datetime] = None) -> None:
+        """Append message to history; `ts` lets batch callers reuse one timestamp"""
+        now = ts or datetime.now(timezone.utc)
         with self._get_db() as db:
-            msg = Message(session_id=session_id, role=role, content=content)
-            db.add(msg)
-            db.commit()
-
-            # Update session last activity
-            session = db.query(Session).filter(Session.id == session_id).first()
-            if session:
-                session.last_activity = datetime.now(timezone.utc)
-                db.commit()
+            self._touch_session(db, session_id, now)
+            db.add(Message(session_id=session_id, role=role, content=content, ts=now))
+            self._commit(db)
+        self._extend_history(session_id, [{"role": role, "content": content, "ts": _db_utc(now).isoformat()}])
+
+    def append_pair(self, session_id: str, user_content: str, assistant_content: str, user_ts: datetime) -> None:
+        """Append a user/assistant exchange with a single multi-row INSERT.
+
+        `user_ts` is when the user message arrived, so it sorts before the reply.
+        An empty/whitespace reply is not stored; the user message still is.
+        """
+        now = datetime.now(timezone.utc)
+        rows = [{"role": "user", "content": user_content, "ts": user_ts}]
+        if assistant_content and assistant_content.strip():
+            rows.append({"role": "assistant", "content": assistant_content, "ts": now})
+        with self._get_db() as db:
+            self._touch_session(db, session_id, now)
+            db.execute(insert(Message).values([{"session_id": session_id, **r} for r in rows]))
+            self._commit(db)
+        self._extend_history(session_id, [{**r, "ts": _db_utc(r["ts"]).isoformat()} for r in rows])
 
     def snapshot(self, session_id: str, limit: int = 50) -> List[dict]:
-        """Get conversation snapshot"""
+        """Get conversation snapshot (read-only, see `get_history`)"""
         return self.get_history(session_id, limit)
 
     # -------- Tasks --------
     def add_task(self, session_id: str, title: str) -> dict:
         """Add new task"""
-        self._ensure_session(session_id)
+        now = datetime.now(timezone.utc)
+        row = {"id": _new_id(), "title": title.strip(), "completed": False, "ts": now}
         with self._get_db() as db:
-            task = Task(
-                id=str(uuid.uuid4()),
-                session_id=session_id,
-                title=title.strip(),
-            )
-            db.add(task)
-            db.commit()
-            return {
-                "id": task.id,
-                "title": task.title,
-                "completed": task.completed,
-                "ts": task.ts.isoformat(),
-            }
+            self._ensure_session(db, session_id)
+            db.execute(insert(Task).values(session_id=session_id, **row))
+            self._commit(db)
+        return {**row, "ts": _db_utc(now).isoformat()}
 
     def list_tasks(self, session_id: str) -> List[dict]:
         """List all tasks"""
         with self._get_db() as db:
-            tasks = db.query(Task).filter(Task.session_id == session_id).all()
+            rows = db.execute(
+                select(Task.id, Task.title, Task.completed, Task.ts)
+                .where(Task.session_id == session_id)
+            ).all()
             return [
-                {
-                    "id": t.id,
-                    "title": t.title,
-                    "completed": t.completed,
-                    "ts": t.ts.isoformat(),
-                }
-                for t in tasks
+                {"id": id_, "title": title, "completed": completed, "ts": ts.isoformat()}
+                for id_, title, completed, ts in rows
+            ]
+
+    def list_task_lines(self, session_id: str) -> List[str]:
+        """List tasks as chat-ready lines ("<id> | <mark> <title>")"""
+        with self._get_db() as db:
+            rows = db.execute(
+                select(Task.id, Task.title, Task.completed)
+                .where(Task.session_id == session_id)
+            ).all()
+            return [
+                f"{id_} | {'✓' if completed else '•'} {title}"
+                for id_, title, completed in rows
             ]
 
     def complete_task(self, session_id: str, task_id: str) -> bool:
         """Mark task as completed"""
         with self._get_db() as db:
-            task = (
-                db.query(Task)
-                .filter(Task.session_id == session_id, Task.id == task_id)
-                .first()
+            res = db.execute(
+                update(Task)
+                .where(Task.session_id == session_id, Task.id == task_id)
+                .values(completed=True)
             )
-            if task:
-                task.completed = True
-                db.commit()
-                return True
-            return False
+            self._commit(db)
+            return res.rowcount > 0
 
     # -------- Reminders --------
     def add_reminder(
         self, session_id: str, text: str, due_ts: Optional[str] = None
     ) -> dict:
         """Add new reminder"""
-        self._ensure_session(session_id)
+        now = datetime.now(timezone.utc)
+        if due_ts is None:
+            due_dt = now + timedelta(minutes=60)
+        else:
+            due_dt = datetime.fromisoformat(due_ts)
+        row = {"id": _new_id(), "text": text.strip(), "due_ts": due_dt, "completed": False, "ts": now}
         with self._get_db() as db:
-            if due_ts is None:
-                due_dt = datetime.now(timezone.utc) + timedelta(minutes=60)
-            else:
-                due_dt = datetime.fromisoformat(due_ts)
-
-            reminder = Reminder(
-                id=str(uuid.uuid4()),
-                session_id=session_id,
-                text=text.strip(),
-                due_ts=due_dt,
-            )
-            db.add(reminder)
-            db.commit()
-            return {
-                "id": reminder.id,
-                "text": reminder.text,
-                "due_ts": reminder.due_ts.isoformat(),
-                "completed": reminder.completed,
-                "ts": reminder.ts.isoformat(),
-            }
+            self._ensure_session(db, session_id)
+            db.execute(insert(Reminder).values(session_id=session_id, **row))
+            self._commit(db)
+        return {**row, "due_ts": _db_utc(due_dt).isoformat(), "ts": _db_utc(now).isoformat()}
 
     def list_reminders(self, session_id: str) -> List[dict]:
         """List all reminders"""
         with self._get_db() as db:
-            reminders = (
-                db.query(Reminder).filter(Reminder.session_id == session_id).all()
-            )
+            rows = db.execute(
+                select(Reminder.id, Reminder.text, Reminder.due_ts, Reminder.completed, Reminder.ts)
+                .where(Reminder.session_id == session_id)
+            ).all()
             return [
                 {
-                    "id": r.id,
-                    "text": r.text,
-                    "due_ts": r.due_ts.isoformat(),
-                    "completed": r.completed,
-                    "ts": r.ts.isoformat(),
+                    "id": id_,
+                    "text": text,
+                    "due_ts": due_ts.isoformat(),
+                    "completed": completed,
+                    "ts": ts.isoformat(),
                 }
-                for r in reminders
+                for id_, text, due_ts, completed, ts in rows
+            ]
+
+    def list_reminder_lines(self, session_id: str) -> List[str]:
+        """List reminders as chat-ready lines ("<id> | <mark> <text> (due <ts>)")"""
+        with self._get_db() as db:
+            rows = db.execute(
+                select(Reminder.id, Reminder.text, Reminder.due_ts, Reminder.completed)
+                .where(Reminder.session_id == session_id)
+            ).all()
+            return [
+                f"{id_} | {'✓' if completed else '•'} {text} (due {due_ts.isoformat()})"
+                for id_, text, due_ts, completed in rows
             ]
 
     def complete_reminder(self, session_id: str, reminder_id: str) -> bool:
         """Mark reminder as completed"""
         with self._get_db() as db:
-            reminder = (
-                db.query(Reminder)
-                .filter(Reminder.session_id == session_id, Reminder.id == reminder_id)
-                .first()
+            res = db.execute(
+                update(Reminder)
+                .where(Reminder.session_id == session_id, Reminder.id == reminder_id)
+                .values(completed=True)
             )
-            if reminder:
-                reminder.completed = True
-                db.commit()
-                return True
-            return False
+            self._commit(db)
+            return res.rowcount > 0
 
     # -------- Check-ins --------
     def add_checkin(
         self, session_id: str, mood: str, energy: int, focus: int, note: str
     ) -> dict:
         """Add check-in"""
-        self._ensure_session(session_id)
+        now = datetime.now(timezone.utc)
+        row = {"id": _new_id(), "mood": mood, "energy": energy, "focus": focus, "note": note or "", "ts": now}
         with self._get_db() as db:
-            checkin = CheckIn(
-                id=str(uuid.uuid4()),
-                session_id=session_id,
-                mood=mood,
-                energy=energy,
-                focus=focus,
-                note=note or "",
-            )
-            db.add(checkin)
-            db.commit()
-            return {
-                "id": checkin.id,
-                "mood": checkin.mood,
-                "energy": checkin.energy,
-                "focus": checkin.focus,
-                "note": checkin.note,
-                "ts": checkin.ts.isoformat(),
-            }
+            self._ensure_session(db, session_id)
+            db.execute(insert(CheckIn).values(session_id=session_id, **row))
+            self._commit(db)
+        return {**row, "ts": _db_utc(now).isoformat()}
 
     def list_checkins(self, session_id: str, limit: int = 7) -> List[dict]:
         """List recent check-ins"""
         with self._get_db() as db:
-            checkins = (
-                db.query(CheckIn)
-                .filter(CheckIn.session_id == session_id)
+            rows = db.execute(
+                select(CheckIn.id, CheckIn.mood, CheckIn.energy, CheckIn.focus, CheckIn.note, CheckIn.ts)
+                .where(CheckIn.session_id == session_id)
                 .order_by(desc(CheckIn.ts))
                 .limit(limit)
-                .all()
-            )
+            ).all()
             return [
                 {
-                    "id": c.id,
-                    "mood": c.mood,
-                    "energy": c.energy,
-                    "focus": c.focus,
-                    "note": c.note,
-                    "ts": c.ts.isoformat(),
+                    "id": id_,
+                    "mood": mood,
+                    "energy": energy,
+                    "focus": focus,
+                    "note": note,
+                    "ts": ts.isoformat(),
                 }
-                for c in reversed(checkins)
+                for id_, mood, energy, focus, note, ts in reversed(rows)
             ]
 
-    # -------- Outbox --------
-    def add_outbox(self, session_id: str, text: str, reason: str) -> dict:
-        """Add message to outbox"""
-        self._ensure_session(session_id)
+    def today_summary(self, session_id: str) -> dict:
+        """Open task/reminder counts and the latest check-in in one query"""
+        open_tasks = (
+            select(func.count(Task.id))
+            .where(Task.session_id == session_id, Task.completed.is_(False))
+            .scalar_subquery()
+        )
+        open_reminders = (
+            select(func.count(Reminder.id))
+            .where(Reminder.session_id == session_id, Reminder.completed.is_(False))
+            .scalar_subquery()
+        )
+        last = (
+            select(CheckIn.id, CheckIn.mood, CheckIn.energy, CheckIn.focus, CheckIn.note, CheckIn.ts)
+            .where(CheckIn.session_id == session_id)
+            .order_by(desc(CheckIn.ts))
+            .limit(1)
+            .subquery()
+        )
+        # LEFT JOIN from a one-row select so sessions without check-ins still get counts
+        one = select(literal(1).label("one")).subquery()
         with self._get_db() as db:
-            msg = OutboundMessage(
-                id=str(uuid.uuid4()),
-                session_id=session_id,
-                text=text,
-                reason=reason,
+            row = db.execute(
+                select(open_tasks, open_reminders, last.c.id, last.c.mood, last.c.energy,
+                       last.c.focus, last.c.note, last.c.ts)
+                .select_from(one.outerjoin(last, true()))
+            ).one()
+            n_tasks, n_reminders, id_, mood, energy, focus, note, ts = row
+            last_checkin = None
+            if id_ is not None:
+                last_checkin = {
+                    "id": id_,
+                    "mood": mood,
+                    "energy": energy,
+                    "focus": focus,
+                    "note": note,
+                    "ts": ts.isoformat(),
+                }
+            return {"open_tasks": n_tasks, "open_reminders": n_reminders, "last_checkin": last_checkin}
+
+    def proactive_state(self, session_id: str, day_start: datetime, day_end: datetime, now: datetime) -> dict:
+        """Inputs for proactive outreach, counted in one query.
+
+        Returns last_activity (aware UTC datetime or None), has_checkin_today (a check-in with
+        day_start <= ts < day_end), overdue_reminders (open, due before `now`)
+        and open_tasks.
+        """
+        last_activity = (
+            select(Session.last_activity).where(Session.id == session_id).scalar_subquery()
+        )
+        has_checkin = (
+            select(CheckIn.id)
+            .where(
+                CheckIn.session_id == session_id,
+                CheckIn.ts >= _db_utc(day_start),
+                CheckIn.ts < _db_utc(day_end),
             )
-            db.add(msg)
-            db.commit()
+            .exists()
+        )
+        overdue = (
+            select(func.count(Reminder.id))
+            .where(
+                Reminder.session_id == session_id,
+                Reminder.completed.is_(False),
+                Reminder.due_ts < _db_utc(now),
+            )
+            .scalar_subquery()
+        )
+        open_tasks = (
+            select(func.count(Task.id))
+            .where(Task.session_id == session_id, Task.completed.is_(False))
+            .scalar_subquery()
+        )
+        with self._get_db() as db:
+            last, has_today, n_overdue, n_tasks = db.execute(
+                select(last_activity, has_checkin, overdue, open_tasks)
+            ).one()
+            # compared, never displayed, so hand back a datetime rather than ISO
+            if last is not None and last.tzinfo is None:
+                last = last.replace(tzinfo=timezone.utc)
             return {
-                "id": msg.id,
-                "text": msg.text,
-                "reason": msg.reason,
-                "ts": msg.ts.isoformat(),
-                "delivered": msg.delivered,
-                "attempts": msg.attempts,
+                "last_activity": last,
+                "has_checkin_today": bool(has_today),
+                "overdue_reminders": n_overdue,
+                "open_tasks": n_tasks,
             }
 
-    def list_outbox(self, session_id: str, limit: int = 20) -> List[dict]:
-        """List outbox messages"""
+    # -------- Outbox --------
+    def add_outbox(self, session_id: str, text: str, reason: str) -> dict:
+        """Add message to outbox"""
+        now = datetime.now(timezone.utc)
+        row = {"id": _new_id(), "text": text, "reason": reason, "ts": now, "delivered": False, "attempts": 0}
         with self._get_db() as db:
-            messages = (
-                db.query(OutboundMessage)
-                .filter(OutboundMessage.session_id == session_id)
-                .order_by(desc(OutboundMessage.ts))
-                .limit(limit)
-                .all()
-            )
+            self._ensure_session(db, session_id)
+            db.execute(insert(OutboundMessage).values(session_id=session_id, **row))
+            self._commit(db)
+            out = {**row, "ts": _db_utc(now).isoformat()}
+            self._after_commit(db, lambda: outbox_events.publish(session_id, out))
+        return out
+
+    def list_outbox(self, session_id: str, limit: int = 20, delivered: Optional[bool] = None) -> List[dict]:
+        """List outbox messages, oldest first.
+
+        Returns the newest `limit` messages; with delivered=False, the oldest
+        `limit` pending ones, so a delivery backlog drains in queue order.
+        """
+        q = select(
+            OutboundMessage.id,
+            OutboundMessage.text,
+            OutboundMessage.reason,
+            OutboundMessage.ts,
+            OutboundMessage.delivered,
+            OutboundMessage.attempts,
+        ).where(OutboundMessage.session_id == session_id)
+        if delivered is not None:
+            q = q.where(OutboundMessage.delivered.is_(delivered))
+        with self._get_db() as db:
+            if delivered is False:
+                rows = db.execute(q.order_by(OutboundMessage.ts).limit(limit)).all()
+            else:
+                rows = db.execute(q.order_by(desc(OutboundMessage.ts)).limit(limit)).all()[::-1]
             return [
                 {
-                    "id": m.id,
-                    "text": m.text,
-                    "reason": m.reason,
-                    "ts": m.ts.isoformat(),
-                    "delivered": m.delivered,
-                    "attempts": m.attempts,
+                    "id": id_,
+                    "text": text,
+                    "reason": reason,
+                    "ts": ts.isoformat(),
+                    "delivered": delivered,
+                    "attempts": attempts,
                 }
-                for m in reversed(messages)
+                for id_, text, reason, ts, delivered, attempts in rows
             ]
 
     def mark_delivered(self, session_id: str, message_id: str) -> bool:
         """Mark outbox message as delivered"""
         with self._get_db() as db:
-            msg = (
-                db.query(OutboundMessage)
-                .filter(
+            res = db.execute(
+                update(OutboundMessage)
+                .where(
                     OutboundMessage.session_id == session_id,
                     OutboundMessage.id == message_id,
                 )
-                .first()
+                .values(delivered=True)
+            )
+            self._commit(db)
+            return res.rowcount > 0
+
+    def mark_delivered_many(self, session_id: str, message_ids: List[str]) -> int:
+        """Mark several outbox messages delivered in one UPDATE; returns how many matched"""
+        if not message_ids:
+            return 0
+        with self._get_db() as db:
+            res = db.execute(
+                update(OutboundMessage)
+                .where(
+                    OutboundMessage.session_id == session_id,
+                    OutboundMessage.id.in_(message_ids),
+                )
+                .values(delivered=True)
             )
-            if msg:
-                msg.delivered = True
-                db.commit()
-                return True
-            return False
+            self._commit(db)
+            return res.rowcount
 
     def mark_outbox_delivered(self, session_id: str, message_id: str, delivered: bool, delivered_at: Optional[str] = None) -> bool:
         """Mark outbox message as delivered with timestamp"""
+        # OutboundMessage has no delivered_at column; the timestamp was never
+        # persisted, so it is accepted and ignored
         with self._get_db() as db:
-            msg = (
-                db.query(OutboundMessage)
-                .filter(
+            res = db.execute(
+                update(OutboundMessage)
+                .where(
                     OutboundMessage.session_id == session_id,
                     OutboundMessage.id == message_id,
                 )
-                .first()
+                .values(delivered=delivered)
             )
-            if msg:
-                msg.delivered = delivered
-                if delivered_at:
-                    from datetime import datetime
-                    msg.delivered_at = datetime.fromisoformat(delivered_at.replace('Z', '+00:00'))
-                db.commit()
-                return True
-            return False
+            self._commit(db)
+            return res.rowcount > 0
 
     def increment_outbox_attempt(self, session_id: str, message_id: str) -> int:
         """Increment delivery attempt counter"""
         with self._get_db() as db:
-            msg = (
-                db.query(OutboundMessage)
-                .filter(
+            # atomic in the DB, so concurrent attempts are not lost
+            attempts = db.execute(
+                update(OutboundMessage)
+                .where(
                     OutboundMessage.session_id == session_id,
                     OutboundMessage.id == message_id,
                 )
-                .first()
-            )
-            if msg:
-                msg.attempts += 1
-                db.commit()
-                return msg.attempts
-            return -1
+                .values(attempts=OutboundMessage.attempts + 1)
+                .returning(OutboundMessage.attempts)
+            ).scalar()
+            self._commit(db)
+            return attempts if attempts is not None else -1
 
     # -------- Inbound Messages --------
     def add_inbound(
@@ -333,69 +594,70 @@ class DatabaseStore:
         channel_id: Optional[str] = None,
         inbound_id: Optional[str] = None,
         raw: Optional[dict] = None,
+        ts: Optional[datetime] = None,
     ) -> dict:
-        """Add inbound message"""
-        self._ensure_session(session_id)
+        """Add inbound message; `ts` lets batch callers reuse one timestamp"""
+        now = ts or datetime.now(timezone.utc)
+        row = {
+            "id": inbound_id or _new_id(),
+            "source": source,
+            "author": author,
+            "text": text.strip(),
+            "ts": now,
+            "raw": raw or {},
+        }
         with self._get_db() as db:
-            msg = InboundMessage(
-                id=inbound_id or str(uuid.uuid4()),
-                session_id=session_id,
-                source=source,
-                author=author,
-                text=text.strip(),
-                raw=raw or {},
-            )
-            db.add(msg)
-
-            # Update session last activity
-            session = db.query(Session).filter(Session.id == session_id).first()
-            if session:
-                session.last_activity = datetime.now(timezone.utc)
-
-            db.commit()
-            return {
-                "id": msg.id,
-                "source": msg.source,
-                "author": msg.author,
-                "text": msg.text,
-                "ts": msg.ts.isoformat(),
-                "raw": msg.raw,
-            }
+            self._touch_session(db, session_id, now)
+            db.execute(insert(InboundMessage).values(session_id=session_id, **row))
+            self._commit(db)
+        self._inbound_cache.set((session_id, row["id"]), True)
+        return {**row, "ts": _db_utc(now).isoformat()}
 
     def list_inbound(self, session_id: str, limit: int = 50) -> List[dict]:
         """List inbound messages"""
         with self._get_db() as db:
-            messages = (
-                db.query(InboundMessage)
-                .filter(InboundMessage.session_id == session_id)
+            rows = db.execute(
+                select(
+                    InboundMessage.id,
+                    InboundMessage.source,
+                    InboundMessage.author,
+                    InboundMessage.text,
+                    InboundMessage.ts,
+                    InboundMessage.raw,
+                )
+                .where(InboundMessage.session_id == session_id)
                 .order_by(desc(InboundMessage.ts))
                 .limit(limit)
-                .all()
-            )
+            ).all()
             return [
                 {
-                    "id": m.id,
-                    "source": m.source,
-                    "author": m.author,
-                    "text": m.text,
-                    "ts": m.ts.isoformat(),
-                    "raw": m.raw,
+                    "id": id_,
+                    "source": source,
+                    "author": author,
+                    "text": text,
+                    "ts": ts.isoformat(),
+                    "raw": raw,
                 }
-                for m in reversed(messages)
+                for id_, source, author, text, ts, raw in reversed(rows)
             ]
 
     def has_inbound_id(self, session_id: str, inbound_id: str) -> bool:
         """Check if inbound message exists (deduplication)"""
+        key = (session_id, inbound_id)
+        if self._inbound_cache.get(key):
+            return True
         with self._get_db() as db:
-            exists = (
-                db.query(InboundMessage)
-                .filter(
+            exists = db.execute(
+                select(InboundMessage.id)
+                .where(
                     InboundMessage.session_id == session_id,
                     InboundMessage.id == inbound_id,
                 )
-                .first()
-            )
-            return exists is not None
+                .limit(1)
+            ).first() is not None
+        if exists:
+            self._inbound_cache.set(key, True)
+        return exists
 
     # -------- Session Bindings --------
     def bind_discord_channel(self, session_id: str, channel_id: str) -> None:
@@ -407,13 +669,19 @@ class DatabaseStore:
                 db.add(session)
             else:
                 session.discord_channel_id = channel_id
-            db.commit()
+            self._commit(db)
+        self._channel_cache.set(session_id, channel_id)
 
     def get_discord_channel(self, session_id: str) -> Optional[str]:
         """Get Discord channel for session"""
+        channel_id = self._channel_cache.get(session_id, _MISSING)
+        if channel_id is not _MISSING:
+            return channel_id
         with self._get_db() as db:
             session = db.query(Session).filter(Session.id == session_id).first()
-            return session.discord_channel_id if session else None
+            channel_id = session.discord_channel_id if session else None
+        self._channel_cache.set(session_id, channel_id)
+        return channel_id
 
     def set_last_user_activity(self, session_id: str, ts_iso: str) -> None:
         """Update last user activity timestamp"""
@@ -421,7 +689,7 @@ class DatabaseStore:
             session = db.query(Session).filter(Session.id == session_id).first()
             if session:
                 session.last_activity = datetime.fromisoformat(ts_iso)
-                db.commit()
+                self._commit(db)
 
     def get_last_user_activity(self, session_id: str) -> Optional[str]:
         """Get last user activity timestamp"""
@@ -433,15 +701,13 @@ class DatabaseStore:
 
     def clear(self, session_id: str) -> None:
         """Clear all session data"""
+        self._history_cache.pop(session_id)
+        self._channel_cache.pop(session_id)
+        # keyed by (session_id, inbound_id); clearing a session is rare
+        self._inbound_cache.clear()
         with self._get_db() as db:
-            db.query(Message).filter(Message.session_id == session_id).delete()
-            db.query(Task).filter(Task.session_id == session_id).delete()
-            db.query(Reminder).filter(Reminder.session_id == session_id).delete()
-            db.query(CheckIn).filter(CheckIn.session_id == session_id).delete()
-            db.query(OutboundMessage).filter(OutboundMessage.session_id == session_id).delete()
-            db.query(InboundMessage).filter(InboundMessage.session_id == session_id).delete()
-            db.query(Session).filter(Session.id == session_id).delete()
-            db.commit()
+            db.execute(_CLEAR_SESSION_SQL, {"sid": session_id})
+            self._commit(db)
 
 
 # Singleton instance
@@ -1,6 +1,18 @@
+import asyncio
+import hashlib
+import json
 import os
-import time
-from typing import List, Dict, Optional
+import threading
+from collections import OrderedDict
+import weakref
+from typing import AsyncIterator, List, Dict, Optional, Tuple
+from dotenv import load_dotenv
+
+from app.semantic_cache import HAS_HNSWLIB, HAS_SENTENCE_TRANSFORMERS, SemanticCache
+from app.log import logger
+
+# Provider config is read once at import, so load .env first
+load_dotenv()
 
 # Try importing LLM providers
 try:
@@ -15,140 +27,331 @@ try:
 except ImportError:
     HAS_OPENAI = False
 
+# Optional simulated latency for the mock provider (ms); off by default
+_MOCK_LATENCY_S = float(os.getenv("LLM_MOCK_LATENCY_MS", "0")) / 1000
+
+_ANTHROPIC_KEY = os.getenv("ANTHROPIC_API_KEY")
+_OPENAI_KEY = os.getenv("OPENAI_API_KEY")
+_PROVIDER = os.getenv("LLM_PROVIDER", "").lower()
+_MODEL = os.getenv("LLM_MODEL")
+
+# Auto-detect provider if not specified
+if not _PROVIDER:
+    if _ANTHROPIC_KEY and HAS_ANTHROPIC:
+        _PROVIDER = "anthropic"
+    elif _OPENAI_KEY and HAS_OPENAI:
+        _PROVIDER = "openai"
+
+# Approximate input-token budget for prior turns (~4 chars/token); the oldest
+# messages are dropped past it. LLM_HISTORY_TOKEN_BUDGET=0 disables trimming.
+_HISTORY_TOKEN_BUDGET = int(os.getenv("LLM_HISTORY_TOKEN_BUDGET", "2000"))
+
+# System prompt for personal assistant. Kept byte-identical across calls so the
+# Anthropic prompt cache can reuse it.
+_SYSTEM_PROMPT = """You are a helpful personal assistant. You help the user manage their tasks, reminders, and daily check-ins.
+
+Be conversational, friendly, and concise. Keep responses brief (1-3 sentences) unless the user asks for more detail.
+
+The user can:
+- Add tasks: "add task [title]" or "todo [title]"
+- Complete tasks: "complete [task_id]"
+- List tasks: "list tasks" or "my tasks"
+- Add reminders: "remind me to [text]" or "remind me in X minutes to [text]"
+- Check in: "check in: mood=happy energy=7 focus=6 note=text"
+- View dashboard: "today" or "dashboard"
 
-def generate_reply(user_message: str, session_id: str, history: Optional[List[Dict[str, str]]] = None) -> str:
+For general conversation, be helpful and supportive."""
+
+# Provider-shaped system payloads, built once; the SDKs don't mutate them
+_CLAUDE_SYSTEM = [{"type": "text", "text": _SYSTEM_PROMPT, "cache_control": {"type": "ephemeral"}}]
+_OPENAI_SYSTEM_MESSAGE = {"role": "system", "content": _SYSTEM_PROMPT}
+
+# One async SDK client per (provider, api_key) and event loop; each keeps its
+# own pooled keep-alive HTTP connections, so reusing it skips the TCP/TLS
+# handshake on later calls. Async clients can't be shared across loops
+# (generate_reply_sync runs a fresh one per call), hence the per-loop map.
+_CLIENTS = weakref.WeakKeyDictionary()  # loop -> {(provider, api_key): client}
+_CLIENTS_LOCK = threading.Lock()
+
+
+def _get_client(provider: str, api_key: str):
+    """Return the shared client for provider on the running loop, creating it on first use."""
+    loop = asyncio.get_running_loop()
+    key = (provider, api_key)
+    with _CLIENTS_LOCK:
+        clients = _CLIENTS.setdefault(loop, {})
+        client = clients.get(key)
+        if client is None:
+            if provider == "anthropic":
+                client = anthropic.AsyncAnthropic(api_key=api_key)
+            else:
+                client = openai.AsyncOpenAI(api_key=api_key)
+            clients[key] = client
+    return client
+
+
+# Exact-match cache of provider replies, keyed by everything sent to the model.
+# LLM_REPLY_CACHE_SIZE=0 disables it.
+_REPLY_CACHE_SIZE = int(os.getenv("LLM_REPLY_CACHE_SIZE", "1024"))
+_REPLY_CACHE: "OrderedDict[str, str]" = OrderedDict()
+_REPLY_CACHE_LOCK = threading.Lock()
+REPLY_CACHE_STATS = {"hits": 0, "misses": 0}
+
+# Optional paraphrase-level cache for first-turn prompts; LLM_SEMANTIC_CACHE=1
+# enables it when sentence-transformers and hnswlib are installed.
+_SEMANTIC_CACHE = (
+    SemanticCache(threshold=float(os.getenv("LLM_SEMANTIC_CACHE_THRESHOLD", "0.87")))
+    if os.getenv("LLM_SEMANTIC_CACHE") == "1" and HAS_SENTENCE_TRANSFORMERS and HAS_HNSWLIB
+    else None
+)
+
+
+def _trim_history(history: Optional[List[Dict[str, str]]], budget_tokens: int = _HISTORY_TOKEN_BUDGET):
+    """Keep the newest messages that fit `budget_tokens`, starting on a user turn."""
+    if not history or budget_tokens <= 0:
+        return history
+    budget_chars = budget_tokens * 4
+    start = len(history)
+    used = 0
+    while start > 0:
+        used += len(history[start - 1]["content"])
+        if used > budget_chars:
+            break
+        start -= 1
+    # don't open the conversation with a dangling assistant reply
+    while start < len(history) and history[start]["role"] != "user":
+        start += 1
+    return history[start:] if start else history
+
+
+def _reply_cache_key(provider: str, user_message: str, history: Optional[List[Dict[str, str]]]) -> str:
+    messages = [
+        {"role": m["role"], "content": m["content"]}
+        for m in history or ()
+        if m.get("role") in ("user", "assistant")
+    ]
+    messages.append({"role": "user", "content": user_message})
+    payload = json.dumps(
+        {"provider": provider, "model": _MODEL, "system": _SYSTEM_PROMPT, "messages": messages},
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _reply_cache_get(key: str) -> Optional[str]:
+    with _REPLY_CACHE_LOCK:
+        reply = _REPLY_CACHE.get(key)
+        if reply is None:
+            REPLY_CACHE_STATS["misses"] += 1
+            return None
+        _REPLY_CACHE.move_to_end(key)
+        REPLY_CACHE_STATS["hits"] += 1
+        return reply
+
+
+def _reply_cache_set(key: str, reply: str) -> None:
+    with _REPLY_CACHE_LOCK:
+        _REPLY_CACHE[key] = reply
+        _REPLY_CACHE.move_to_end(key)
+        while len(_REPLY_CACHE) > _REPLY_CACHE_SIZE:
+            _REPLY_CACHE.popitem(last=False)
+
+
+def _select_provider() -> Tuple[Optional[str], Optional[str]]:
+    """Return (provider, api_key) for the configured provider, or (None, None) for the mock."""
+    # Try Claude (Anthropic)
+    if _PROVIDER == "anthropic" and _ANTHROPIC_KEY and HAS_ANTHROPIC:
+        return "anthropic", _ANTHROPIC_KEY
+    # Try OpenAI
+    if _PROVIDER == "openai" and _OPENAI_KEY and HAS_OPENAI:
+        return "openai", _OPENAI_KEY
+    return None, None
+
+
+async def _cached_reply(user_message: str, history: Optional[List[Dict[str, str]]]):
+    """Check the reply caches; returns (reply or None, exact key, embedding) for `_remember_reply`."""
+    key = _reply_cache_key(_PROVIDER, user_message, history) if _REPLY_CACHE_SIZE > 0 else None
+    if key is not None:
+        cached = _reply_cache_get(key)
+        if cached is not None:
+            return cached, key, None
+    # Paraphrase matching is only safe without prior context
+    emb = None
+    if _SEMANTIC_CACHE is not None and not history:
+        cached, emb = await asyncio.to_thread(_SEMANTIC_CACHE.lookup, user_message)
+        if cached is not None:
+            return cached, key, emb
+    return None, key, emb
+
+
+def _remember_reply(key: Optional[str], emb, reply: str) -> None:
+    if key is not None:
+        _reply_cache_set(key, reply)
+    if emb is not None:
+        _SEMANTIC_CACHE.add(emb, reply)
+
+
+async def generate_reply(user_message: str, session_id: str, history: Optional[List[Dict[str, str]]] = None) -> str:
     """
     Generate a reply using Claude (Anthropic) or OpenAI, with mock fallback.
 
-    Environment variables:
+    Environment variables (read once at import):
     - ANTHROPIC_API_KEY: Claude API key (preferred)
     - OPENAI_API_KEY: OpenAI API key (fallback)
     - LLM_PROVIDER: "anthropic" or "openai" (optional, auto-detects based on keys)
     - LLM_MODEL: Model name (optional, defaults: claude-3-sonnet-20240229 or gpt-4)
+    - LLM_MOCK_LATENCY_MS: simulated delay for mock replies (optional, default 0)
+    - LLM_REPLY_CACHE_SIZE: max cached provider replies (optional, default 1024, 0 disables)
+    - LLM_SEMANTIC_CACHE: "1" to also reuse replies to similar first-turn messages (optional)
+    - LLM_HISTORY_TOKEN_BUDGET: approx. tokens of prior turns to send (optional, default 2000, 0 = all)
     """
-    provider = os.getenv("LLM_PROVIDER", "").lower()
-    anthropic_key = os.getenv("ANTHROPIC_API_KEY")
-    openai_key = os.getenv("OPENAI_API_KEY")
-
-    # Auto-detect provider if not specified
-    if not provider:
-        if anthropic_key and HAS_ANTHROPIC:
-            provider = "anthropic"
-        elif openai_key and HAS_OPENAI:
-            provider = "openai"
-
-    # Try Claude (Anthropic)
-    if provider == "anthropic" and anthropic_key and HAS_ANTHROPIC:
-        return _generate_with_claude(user_message, session_id, history, anthropic_key)
-
-    # Try OpenAI
-    if provider == "openai" and openai_key and HAS_OPENAI:
-        return _generate_with_openai(user_message, session_id, history, openai_key)
-
-    # Fallback to mock
+    history = _trim_history(history)
+    provider, api_key = _select_provider()
+    if provider is not None:
+        cached, key, emb = await _cached_reply(user_message, history)
+        if cached is not None:
+            return cached
+        provider_call = _generate_with_claude if provider == "anthropic" else _generate_with_openai
+        reply = await provider_call(user_message, session_id, history, api_key)
+        if reply is not None:
+            _remember_reply(key, emb, reply)
+            return reply
+
+    # Fallback to mock (also used when the provider call failed)
+    if _MOCK_LATENCY_S > 0:
+        await asyncio.sleep(_MOCK_LATENCY_S)
     return _generate_mock(user_message, session_id, history)
 
 
-def _generate_with_claude(
+async def stream_reply(user_message: str, session_id: str, history: Optional[List[Dict[str, str]]] = None) -> AsyncIterator[str]:
+    """Like `generate_reply`, but yield the reply in chunks as the provider streams it.
+
+    Falls back to the mock when no provider is configured or the stream fails
+    before producing any text; a stream that fails midway just ends early.
+    """
+    history = _trim_history(history)
+    provider, api_key = _select_provider()
+    if provider is not None:
+        cached, key, emb = await _cached_reply(user_message, history)
+        if cached is not None:
+            yield cached
+            return
+        provider_stream = _stream_with_claude if provider == "anthropic" else _stream_with_openai
+        parts = []
+        try:
+            async for delta in provider_stream(user_message, history, api_key):
+                parts.append(delta)
+                yield delta
+        except Exception as e:
+            logger.info("[LLM ERROR] %s stream failed: %s", provider, e)
+            if parts:
+                return
+        else:
+            _remember_reply(key, emb, "".join(parts))
+            return
+
+    if _MOCK_LATENCY_S > 0:
+        await asyncio.sleep(_MOCK_LATENCY_S)
+    yield _generate_mock(user_message, session_id, history)
+
+
+def generate_reply_sync(user_message: str, session_id: str, history: Optional[List[Dict[str, str]]] = None) -> str:
+    """Blocking wrapper around `generate_reply` for callers without an event loop."""
+    return asyncio.run(generate_reply(user_message, session_id, history))
+
+
+def _claude_messages(user_message: str, history: Optional[List[Dict[str, str]]]) -> List[dict]:
+    """Build the Claude messages array from history plus the current message."""
+    messages = []
+    if history:
+        for msg in history:
+            if msg.get("role") in ("user", "assistant"):
+                messages.append({
+                    "role": msg["role"],
+                    "content": msg["content"]
+                })
+
+    # Mark the end of the stored history as a cache breakpoint so the
+    # conversation prefix is reused on the next turn
+    if messages:
+        messages[-1] = {
+            "role": messages[-1]["role"],
+            "content": [{"type": "text", "text": messages[-1]["content"], "cache_control": {"type": "ephemeral"}}],
+        }
+
+    # Add current user message
+    messages.append({
+        "role": "user",
+        "content": user_message
+    })
+    return messages
+
+
+async def _generate_with_claude(
     user_message: str,
     session_id: str,
     history: Optional[List[Dict[str, str]]],
     api_key: str
-) -> str:
-    """Generate reply using Claude (Anthropic)."""
+) -> Optional[str]:
+    """Generate reply using Claude (Anthropic); None if the call failed."""
     try:
-        client = anthropic.Anthropic(api_key=api_key)
-        model = os.getenv("LLM_MODEL", "claude-3-haiku-20240307")
-
-        # Build messages array from history
-        messages = []
-        if history:
-            for msg in history:
-                if msg.get("role") in ("user", "assistant"):
-                    messages.append({
-                        "role": msg["role"],
-                        "content": msg["content"]
-                    })
-
-        # Add current user message
-        messages.append({
-            "role": "user",
-            "content": user_message
-        })
-
-        # System prompt for personal assistant
-        system_prompt = """You are a helpful personal assistant. You help the user manage their tasks, reminders, and daily check-ins.
-
-Be conversational, friendly, and concise. Keep responses brief (1-3 sentences) unless the user asks for more detail.
+        client = _get_client("anthropic", api_key)
+        model = _MODEL or "claude-3-haiku-20240307"
 
-The user can:
-- Add tasks: "add task [title]" or "todo [title]"
-- Complete tasks: "complete [task_id]"
-- List tasks: "list tasks" or "my tasks"
-- Add reminders: "remind me to [text]" or "remind me in X minutes to [text]"
-- Check in: "check in: mood=happy energy=7 focus=6 note=text"
-- View dashboard: "today" or "dashboard"
-
-For general conversation, be helpful and supportive."""
+        messages = _claude_messages(user_message, history)
 
-        response = client.messages.create(
+        response = await client.messages.create(
             model=model,
             max_tokens=1024,
-            system=system_prompt,
+            system=_CLAUDE_SYSTEM,
             messages=messages
         )
 
+        usage = response.usage
+        logger.info("[LLM] session_id=%s cache_read_input_tokens=%s cache_creation_input_tokens=%s",
+                    session_id, getattr(usage, "cache_read_input_tokens", None),
+                    getattr(usage, "cache_creation_input_tokens", None))
+
         return response.content[0].text
 
     except Exception as e:
-        print(f"[LLM ERROR] Claude failed: {e}")
-        return _generate_mock(user_message, session_id, history)
+        logger.info("[LLM ERROR] Claude failed: %s", e)
+        return None
 
 
-def _generate_with_openai(
+def _openai_messages(user_message: str, history: Optional[List[Dict[str, str]]]) -> List[dict]:
+    """Build the OpenAI messages array: system prompt, history, current message."""
+    messages = [_OPENAI_SYSTEM_MESSAGE]
+    if history:
+        for msg in history:
+            if msg.get("role") in ("user", "assistant"):
+                messages.append({
+                    "role": msg["role"],
+                    "content": msg["content"]
+                })
+
+    # Add current user message
+    messages.append({
+        "role": "user",
+        "content": user_message
+    })
+    return messages
+
+
+async def _generate_with_openai(
     user_message: str,
     session_id: str,
     history: Optional[List[Dict[str, str]]],
     api_key: str
-) -> str:
-    """Generate reply using OpenAI."""
+) -> Optional[str]:
+    """Generate reply using OpenAI; None if the call failed."""
     try:
-        client = openai.OpenAI(api_key=api_key)
-        model = os.getenv("LLM_MODEL", "gpt-4")
-
-        # Build messages array from history
-        messages = [{
-            "role": "system",
-            "content": """You are a helpful personal assistant. You help the user manage their tasks, reminders, and daily check-ins.
+        client = _get_client("openai", api_key)
+        model = _MODEL or "gpt-4"
 
-Be conversational, friendly, and concise. Keep responses brief (1-3 sentences) unless the user asks for more detail.
+        messages = _openai_messages(user_message, history)
 
-The user can:
-- Add tasks: "add task [title]" or "todo [title]"
-- Complete tasks: "complete [task_id]"
-- List tasks: "list tasks" or "my tasks"
-- Add reminders: "remind me to [text]" or "remind me in X minutes to [text]"
-- Check in: "check in: mood=happy energy=7 focus=6 note=text"
-- View dashboard: "today" or "dashboard"
-
-For general conversation, be helpful and supportive."""
-        }]
-
-        if history:
-            for msg in history:
-                if msg.get("role") in ("user", "assistant"):
-                    messages.append({
-                        "role": msg["role"],
-                        "content": msg["content"]
-                    })
-
-        # Add current user message
-        messages.append({
-            "role": "user",
-            "content": user_message
-        })
-
-        response = client.chat.completions.create(
+        response = await client.chat.completions.create(
             model=model,
             messages=messages,
             max_tokens=1024
@@ -157,14 +360,47 @@ For general conversation, be helpful and supportive."""
         return response.choices[0].message.content
 
     except Exception as e:
-        print(f"[LLM ERROR] OpenAI failed: {e}")
-        return _generate_mock(user_message, session_id, history)
+        logger.info("[LLM ERROR] OpenAI failed: %s", e)
+        return None
+
+
+async def _stream_with_claude(
+    user_message: str,
+    history: Optional[List[Dict[str, str]]],
+    api_key: str
+) -> AsyncIterator[str]:
+    """Stream reply text deltas from Claude (Anthropic)."""
+    client = _get_client("anthropic", api_key)
+    async with client.messages.stream(
+        model=_MODEL or "claude-3-haiku-20240307",
+        max_tokens=1024,
+        system=_CLAUDE_SYSTEM,
+        messages=_claude_messages(user_message, history)
+    ) as stream:
+        async for text in stream.text_stream:
+            yield text
+
+
+async def _stream_with_openai(
+    user_message: str,
+    history: Optional[List[Dict[str, str]]],
+    api_key: str
+) -> AsyncIterator[str]:
+    """Stream reply text deltas from OpenAI."""
+    client = _get_client("openai", api_key)
+    stream = await client.chat.completions.create(
+        model=_MODEL or "gpt-4",
+        messages=_openai_messages(user_message, history),
+        max_tokens=1024,
+        stream=True
+    )
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
 
 
 def _generate_mock(user_message: str, session_id: str, history: Optional[List[Dict[str, str]]]) -> str:
     """Mock LLM fallback for testing without API keys."""
-    time.sleep(0.05)
-
     text = user_message.strip()
     if not text:
         return "Say something and I'll respond."
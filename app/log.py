@@ -0,0 +1,24 @@
+# app/log.py
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+
+# Request-path logging goes through a queue; a listener thread does the
+# formatting and the stdout write, so handlers never block a request.
+# Lines keep the "[TAG] key=value" shape the print() calls used.
+_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+
+_stream = logging.StreamHandler(sys.stdout)
+_stream.setFormatter(logging.Formatter("%(message)s"))
+
+_listener = logging.handlers.QueueListener(_queue, _stream)
+_listener.start()
+atexit.register(_listener.stop)
+
+logger = logging.getLogger("app")
+logger.setLevel(logging.INFO)
+logger.addHandler(logging.handlers.QueueHandler(_queue))
+# uvicorn configures the root logger; keep our lines from printing twice
+logger.propagate = False
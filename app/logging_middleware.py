@@ -1,12 +1,15 @@
 import time
-import uuid
+from secrets import token_hex
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.requests import Request
 
+from app.log import logger
+
+
 class RequestLoggingMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next):
         start = time.perf_counter()
-        request_id = str(uuid.uuid4())
+        request_id = token_hex(16)
 
         # session_id can come from header OR generated later in /chat
         session_id = request.headers.get("x-session-id")
@@ -14,17 +17,17 @@ class RequestLoggingMiddleware(BaseHTTPMiddleware):
         request.state.request_id = request_id
         request.state.session_id = session_id
 
-        print(f"[START] request_id={request_id} session_id={session_id} {request.method} {request.url.path}")
+        logger.info("[START] request_id=%s session_id=%s %s %s", request_id, session_id, request.method, request.url.path)
 
         try:
             response = await call_next(request)
         except Exception as e:
             duration_ms = int((time.perf_counter() - start) * 1000)
-            print(f"[ERROR] request_id={request_id} session_id={session_id} duration_ms={duration_ms} err={repr(e)}")
+            logger.info("[ERROR] request_id=%s session_id=%s duration_ms=%s err=%r", request_id, session_id, duration_ms, e)
             raise
 
         duration_ms = int((time.perf_counter() - start) * 1000)
-        print(f"[END]   request_id={request_id} session_id={session_id} status={response.status_code} duration_ms={duration_ms}")
+        logger.info("[END]   request_id=%s session_id=%s status=%s duration_ms=%s", request_id, session_id, response.status_code, duration_ms)
 
         # Return IDs to client for traceability
         response.headers["x-request-id"] = request_id
@@ -1,21 +1,31 @@
+import asyncio
+import json
 import os
-import uuid
+from secrets import token_hex
+from typing import Optional
 
 from dotenv import load_dotenv
-from fastapi import FastAPI, Request
+from fastapi import Depends, FastAPI, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+import orjson
 
-from app.agent import handle_message
-from app.schemas import ChatRequest, ChatResponse, DiscordIngestRequest, DiscordIngestResponse, DiscordInboundEvent, BindDiscordChannelRequest
+from app.agent import handle_message, stream_message
+from app.schemas import CHAT_REQUEST_OPENAPI, ChatRequest, ChatResponse, DiscordIngestRequest, DiscordIngestResponse, DiscordInboundEvent, BindDiscordChannelRequest, BulkDeliverRequest, parse_chat_request
 from app.logging_middleware import RequestLoggingMiddleware
+from app.log import logger
 from app.memory import store
+from app import outbox_events
 from app.proactive import proactive_prompt
 from app.tools import run_tool
 from datetime import datetime, timezone
 
 load_dotenv()
 
-app = FastAPI(title="Assistant Agent MVP", version="0.2.0")
+# store rows are already plain dicts; orjson serializes them without a
+# jsonable_encoder pass
+app = FastAPI(title="Assistant Agent MVP", version="0.2.0", default_response_class=ORJSONResponse)
 app.add_middleware(RequestLoggingMiddleware)
 
 
@@ -31,19 +41,13 @@ def health_check():
 @app.get("/sessions/{session_id}")
 def get_session(session_id: str):
     msgs = store.snapshot(session_id=session_id, limit=50)
-    return {
-        "session_id": session_id,
-        "messages": [{"role": m.role, "content": m.content, "ts": m.ts} for m in msgs],
-    }
+    return {"session_id": session_id, "messages": msgs}
 
 
 @app.get("/sessions/{session_id}/tasks")
 def get_tasks(session_id: str):
     tasks = store.list_tasks(session_id=session_id)
-    return {
-        "session_id": session_id,
-        "tasks": [t.__dict__ for t in tasks],
-    }
+    return {"session_id": session_id, "tasks": tasks}
 
 
 @app.get("/sessions/{session_id}/proactive")
@@ -59,13 +63,13 @@ def get_proactive(session_id: str):
 @app.get("/sessions/{session_id}/reminders")
 def get_reminders(session_id: str):
     reminders = store.list_reminders(session_id=session_id)
-    return {"session_id": session_id, "reminders": [r.__dict__ for r in reminders]}
+    return {"session_id": session_id, "reminders": reminders}
 
 
 @app.get("/sessions/{session_id}/checkins")
 def get_checkins(session_id: str):
     c = store.list_checkins(session_id=session_id)
-    return {"session_id": session_id, "checkins": [ck.__dict__ for ck in c]}
+    return {"session_id": session_id, "checkins": c}
 
 
 @app.get("/sessions/{session_id}/dashboard")
@@ -92,22 +96,74 @@ def proactive_tick(session_id: str):
         last = out[-1]
     if last:
         try:
-            last_ts = datetime.fromisoformat(last.ts)
-            if last.text == msg and (datetime.now(timezone.utc) - last_ts).total_seconds() < 3600:
+            last_ts = datetime.fromisoformat(last["ts"])
+            if last_ts.tzinfo is None:
+                # outbox timestamps are stored as naive UTC
+                last_ts = last_ts.replace(tzinfo=timezone.utc)
+            if last["text"] == msg and (datetime.now(timezone.utc) - last_ts).total_seconds() < 3600:
                 return {"queued": False, "message": None}
-        except Exception:
+        except ValueError:
             pass
 
     queued = store.add_outbox(session_id=session_id, text=msg, reason="proactive_tick")
-    return {"queued": True, "message": queued.text}
+    return {"queued": True, "message": queued["text"]}
 
 
 @app.get("/sessions/{session_id}/outbox")
-def get_outbox(session_id: str):
-    msgs = store.list_outbox(session_id=session_id)
+def get_outbox(session_id: str, delivered: Optional[bool] = None, limit: int = 20):
+    """List outbox messages; `?delivered=false` returns only pending ones, oldest first."""
+    msgs = store.list_outbox(session_id=session_id, limit=limit, delivered=delivered)
     return {"session_id": session_id, "outbox": msgs}
 
 
+# Seconds between DB re-checks of an outbox stream, each followed by a
+# keepalive comment. A re-check picks up rows queued by another worker process
+# and re-offers rows the client was sent but has not marked delivered.
+_OUTBOX_STREAM_KEEPALIVE = 15
+
+
+@app.get("/sessions/{session_id}/outbox/stream")
+async def outbox_stream(session_id: str):
+    """Stream undelivered outbox messages as server-sent events.
+
+    Each event is `data: <outbox message JSON>`. Messages already queued are
+    sent first, then new ones as they are added. A message still undelivered
+    a full interval after it was sent is sent again, so a failed send is retried.
+    """
+    queue = outbox_events.subscribe(session_id)
+
+    def pending():
+        return store.list_outbox(session_id=session_id, limit=50, delivered=False)
+
+    async def events():
+        loop = asyncio.get_running_loop()
+        # id -> loop time it was last sent; only undelivered ids are kept
+        sent = {}
+        try:
+            backlog = await run_in_threadpool(pending)
+            next_check = loop.time() + _OUTBOX_STREAM_KEEPALIVE
+            while True:
+                for m in backlog:
+                    if m["id"] not in sent:
+                        sent[m["id"]] = loop.time()
+                        yield f"data: {orjson.dumps(m).decode()}\n\n"
+                try:
+                    backlog = [await asyncio.wait_for(queue.get(), max(next_check - loop.time(), 0))]
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    backlog = await run_in_threadpool(pending)
+                    now = loop.time()
+                    # forget delivered ids, and ones sent long enough ago that
+                    # the client should have acked them by now
+                    sent = {m["id"]: sent[m["id"]] for m in backlog
+                            if now - sent.get(m["id"], now - _OUTBOX_STREAM_KEEPALIVE) < _OUTBOX_STREAM_KEEPALIVE}
+                    next_check = now + _OUTBOX_STREAM_KEEPALIVE
+        finally:
+            outbox_events.unsubscribe(session_id, queue)
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
 @app.patch("/sessions/{session_id}/outbox/{message_id}")
 def outbox_delivered(session_id: str, message_id: str):
     """Mark an outbox message delivered.
@@ -118,6 +174,16 @@ def outbox_delivered(session_id: str, message_id: str):
     return {"ok": bool(ok)}
 
 
+@app.post("/sessions/{session_id}/outbox/bulk_deliver")
+def outbox_bulk_delivered(session_id: str, payload: BulkDeliverRequest):
+    """Mark several outbox messages delivered in one call.
+
+    Returns {"ok": true/false, "updated": <int>}
+    """
+    updated = store.mark_delivered_many(session_id=session_id, message_ids=payload.ids)
+    return {"ok": updated == len(set(payload.ids)), "updated": updated}
+
+
 @app.post("/sessions/{session_id}/outbox/{message_id}/attempt")
 def outbox_attempt(session_id: str, message_id: str):
     """Increment attempt counter for an outbox message.
@@ -136,48 +202,78 @@ def clear_session(session_id: str):
     return {"status": "cleared", "session_id": session_id}
 
 
-@app.post("/chat", response_model=ChatResponse)
-async def chat(payload: ChatRequest, request: Request):
-    request_id = getattr(request.state, "request_id", str(uuid.uuid4()))
+@app.post("/chat", response_model=ChatResponse, openapi_extra=CHAT_REQUEST_OPENAPI)
+async def chat(request: Request, payload: ChatRequest = Depends(parse_chat_request)):
+    request_id = getattr(request.state, "request_id", None) or token_hex(16)
 
-    session_id = payload.session_id or getattr(request.state, "session_id", None) or str(uuid.uuid4())
+    session_id = payload.session_id or getattr(request.state, "session_id", None) or token_hex(16)
     request.state.session_id = session_id
 
     normalized_text = payload.message.strip()
-
-    # store user message once
-    store.append(session_id=session_id, role="user", content=normalized_text)
+    received_ts = datetime.now(timezone.utc)
 
     # agent decides tool vs llm
-    reply = handle_message(normalized_text, session_id)
+    reply = await handle_message(normalized_text, session_id)
 
-    # store assistant once
-    store.append(session_id=session_id, role="assistant", content=reply)
+    # store user and assistant once each, in one INSERT
+    await run_in_threadpool(store.append_pair, session_id, normalized_text, reply, user_ts=received_ts)
 
-    return ChatResponse(
+    # built from our own values and validated again as response_model
+    return ChatResponse.model_construct(
         request_id=request_id,
         session_id=session_id,
         reply=reply,
     )
 
 
+@app.post("/chat/stream", openapi_extra=CHAT_REQUEST_OPENAPI)
+async def chat_stream(request: Request, payload: ChatRequest = Depends(parse_chat_request)):
+    """Like /chat, but stream the reply as server-sent events.
+
+    Each event is `data: {"delta": "..."}`; a final `data: {"done": true, ...}`
+    carries the request and session ids.
+    """
+    request_id = getattr(request.state, "request_id", None) or token_hex(16)
+
+    session_id = payload.session_id or getattr(request.state, "session_id", None) or token_hex(16)
+    request.state.session_id = session_id
+
+    normalized_text = payload.message.strip()
+    received_ts = datetime.now(timezone.utc)
+
+    async def events():
+        parts = []
+        try:
+            async for delta in stream_message(normalized_text, session_id):
+                parts.append(delta)
+                yield f"data: {json.dumps({'delta': delta})}\n\n"
+            yield f"data: {json.dumps({'done': True, 'request_id': request_id, 'session_id': session_id})}\n\n"
+        finally:
+            # store user and assistant once each, including a partial reply
+            # if the client went away (the threadpool call is not cancelled)
+            await run_in_threadpool(store.append_pair, session_id, normalized_text, "".join(parts), user_ts=received_ts)
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
 @app.post("/integrations/discord/ingest", response_model=DiscordIngestResponse)
 async def discord_ingest(payload: DiscordIngestRequest, request: Request):
     """Ingest a Discord message: store inbound, run agent, queue reply.
 
     Handles deduplication via message_id to prevent repeated processing.
     """
-    request_id = getattr(request.state, "request_id", str(uuid.uuid4()))
+    request_id = getattr(request.state, "request_id", None) or token_hex(16)
     session_id = payload.session_id
     request.state.session_id = session_id
 
     # Deduplication check
-    if store.has_inbound_id(session_id, payload.message_id):
-        print(f"[DISCORD] request_id={request_id} session_id={session_id} deduped message_id={payload.message_id}")
-        return DiscordIngestResponse(ok=True, deduped=True, queued_reply=False, reply_text=None)
+    if await run_in_threadpool(store.has_inbound_id, session_id, payload.message_id):
+        logger.info("[DISCORD] request_id=%s session_id=%s deduped message_id=%s", request_id, session_id, payload.message_id)
+        return DiscordIngestResponse.model_construct(ok=True, deduped=True, queued_reply=False, reply_text=None)
 
     # Store inbound message
-    store.add_inbound(
+    await run_in_threadpool(
+        store.add_inbound,
         session_id=session_id,
         author=payload.author,
         text=payload.content,
@@ -186,23 +282,22 @@ async def discord_ingest(payload: DiscordIngestRequest, request: Request):
         inbound_id=payload.message_id,
     )
 
-    # Append to chat history as user message
-    store.append(session_id=session_id, role="user", content=payload.content)
+    received_ts = datetime.now(timezone.utc)
 
     # Run agent routing
-    reply_text = handle_message(payload.content, session_id)
+    reply_text = await handle_message(payload.content, session_id)
 
-    # Store assistant reply and queue to outbox if present
-    store.append(session_id=session_id, role="assistant", content=reply_text)
+    # Append the exchange to chat history and queue to outbox if present
+    await run_in_threadpool(store.append_pair, session_id, payload.content, reply_text, user_ts=received_ts)
     
     queued_reply = False
     if reply_text and reply_text.strip():
-        store.add_outbox(session_id=session_id, text=reply_text, reason="discord_reply")
+        await run_in_threadpool(store.add_outbox, session_id=session_id, text=reply_text, reason="discord_reply")
         queued_reply = True
 
-    print(f"[DISCORD] request_id={request_id} session_id={session_id} ingested message_id={payload.message_id} queued_reply={queued_reply}")
+    logger.info("[DISCORD] request_id=%s session_id=%s ingested message_id=%s queued_reply=%s", request_id, session_id, payload.message_id, queued_reply)
 
-    return DiscordIngestResponse(
+    return DiscordIngestResponse.model_construct(
         ok=True,
         deduped=False,
         queued_reply=queued_reply,
@@ -216,11 +311,11 @@ async def bind_discord_channel(session_id: str, payload: BindDiscordChannelReque
 
     Returns: {"ok": true}
     """
-    request_id = getattr(request.state, "request_id", str(uuid.uuid4()))
+    request_id = getattr(request.state, "request_id", None) or token_hex(16)
     request.state.session_id = session_id
 
-    store.bind_discord_channel(session_id=session_id, channel_id=payload.channel_id)
-    print(f"[BIND] request_id={request_id} session_id={session_id} bound to discord channel={payload.channel_id}")
+    await run_in_threadpool(store.bind_discord_channel, session_id=session_id, channel_id=payload.channel_id)
+    logger.info("[BIND] request_id=%s session_id=%s bound to discord channel=%s", request_id, session_id, payload.channel_id)
 
     return {"ok": True}
 
@@ -234,7 +329,7 @@ async def ingest_inbound_discord(payload: DiscordInboundEvent, request: Request)
 
     Returns: {"ok": bool, "session_id": str, "ingested": bool, "reply_text": optional[str]}
     """
-    request_id = getattr(request.state, "request_id", str(uuid.uuid4()))
+    request_id = getattr(request.state, "request_id", None) or token_hex(16)
 
     # MVP: hardcode or lookup session by channel binding
     # For now, lookup via channel_id binding (requires pre-bind call)
@@ -244,39 +339,42 @@ async def ingest_inbound_discord(payload: DiscordInboundEvent, request: Request)
     session_id = os.getenv("DISCORD_SESSION_ID", None)
     
     if not session_id:
-        print(f"[INBOUND] request_id={request_id} no session_id configured (set DISCORD_SESSION_ID env var)")
+        logger.info("[INBOUND] request_id=%s no session_id configured (set DISCORD_SESSION_ID env var)", request_id)
         return {"ok": False, "session_id": None, "ingested": False, "reply_text": None}
 
     request.state.session_id = session_id
 
     # Check for duplicate
-    if store.has_inbound_id(session_id, payload.message_id):
-        print(f"[INBOUND] request_id={request_id} session_id={session_id} deduped message_id={payload.message_id}")
+    if await run_in_threadpool(store.has_inbound_id, session_id, payload.message_id):
+        logger.info("[INBOUND] request_id=%s session_id=%s deduped message_id=%s", request_id, session_id, payload.message_id)
         return {"ok": True, "session_id": session_id, "ingested": False, "reply_text": None}
 
     # Store inbound message (for tracking)
-    store.add_inbound(
-        session_id=session_id,
-        author=payload.author,
-        text=payload.content.strip(),
-        source="discord",
-        channel_id=payload.channel_id,
-        inbound_id=payload.message_id,
-        raw=payload.raw or {},
-    )
-    store.set_last_user_activity(session_id=session_id, ts_iso=payload.ts)
-
-    print(f"[INBOUND] request_id={request_id} session_id={session_id} stored message_id={payload.message_id} from {payload.author}")
+    def store_inbound():
+        store.add_inbound(
+            session_id=session_id,
+            author=payload.author,
+            text=payload.content.strip(),
+            source="discord",
+            channel_id=payload.channel_id,
+            inbound_id=payload.message_id,
+            raw=payload.raw or {},
+        )
+        store.set_last_user_activity(session_id=session_id, ts_iso=payload.ts)
+
+    await run_in_threadpool(store_inbound)
+
+    logger.info("[INBOUND] request_id=%s session_id=%s stored message_id=%s from %s", request_id, session_id, payload.message_id, payload.author)
 
     # Call agent to generate reply
-    reply_text = handle_message(payload.content, session_id)
+    reply_text = await handle_message(payload.content, session_id)
 
     # Queue reply if present
     queued_reply = False
     if reply_text and reply_text.strip():
-        store.add_outbox(session_id=session_id, text=reply_text, reason="inbound_discord_reply")
+        await run_in_threadpool(store.add_outbox, session_id=session_id, text=reply_text, reason="inbound_discord_reply")
         queued_reply = True
-        print(f"[INBOUND] request_id={request_id} session_id={session_id} queued reply: {reply_text[:60]}...")
+        logger.info("[INBOUND] request_id=%s session_id=%s queued reply: %s...", request_id, session_id, reply_text[:60])
 
     return {
         "ok": True,
@@ -295,7 +393,7 @@ def get_inbox(session_id: str):
     msgs = store.list_inbound(session_id=session_id, limit=50)
     return {
         "session_id": session_id,
-        "inbox": [{"id": m.id, "source": m.source, "author": m.author, "text": m.text, "ts": m.ts} for m in msgs],
+        "inbox": [{k: m[k] for k in ("id", "source", "author", "text", "ts")} for m in msgs],
     }
 
 
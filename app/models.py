@@ -1,9 +1,17 @@
 from dotenv import load_dotenv
 import os
 from datetime import datetime, timezone
-from sqlalchemy import create_engine, Column, String, Integer, Boolean, DateTime, Text, JSON
+from sqlalchemy import create_engine, inspect, text, Column, String, Integer, Boolean, DateTime, Text, JSON, Index, ForeignKey
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import DeclarativeBase, sessionmaker
 
+# Optional faster JSON codec for JSON/JSONB columns
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
 # CRITICAL: Load .env BEFORE accessing os.getenv()
 load_dotenv()
 
@@ -27,18 +35,21 @@ class Message(Base):
     __tablename__ = "messages"
     
     id = Column(Integer, primary_key=True, autoincrement=True)
-    session_id = Column(String(255), index=True, nullable=False)
+    session_id = Column(String(255), ForeignKey("sessions.id", ondelete="CASCADE"), index=True, nullable=False)
     role = Column(String(50), nullable=False)
     content = Column(Text, nullable=False)
     ts = Column(DateTime, default=lambda: datetime.now(timezone.utc))
 
+    # "latest N for a session" reads: WHERE session_id = ? ORDER BY ts DESC LIMIT N
+    __table_args__ = (Index("ix_messages_session_ts", "session_id", ts.desc()),)
+
 
 class Task(Base):
     """User tasks"""
     __tablename__ = "tasks"
     
     id = Column(String(255), primary_key=True)
-    session_id = Column(String(255), index=True, nullable=False)
+    session_id = Column(String(255), ForeignKey("sessions.id", ondelete="CASCADE"), index=True, nullable=False)
     title = Column(String(500), nullable=False)
     completed = Column(Boolean, default=False)
     ts = Column(DateTime, default=lambda: datetime.now(timezone.utc))
@@ -49,50 +60,72 @@ class Reminder(Base):
     __tablename__ = "reminders"
     
     id = Column(String(255), primary_key=True)
-    session_id = Column(String(255), index=True, nullable=False)
+    session_id = Column(String(255), ForeignKey("sessions.id", ondelete="CASCADE"), index=True, nullable=False)
     text = Column(String(500), nullable=False)
     due_ts = Column(DateTime, nullable=False)
     completed = Column(Boolean, default=False)
     ts = Column(DateTime, default=lambda: datetime.now(timezone.utc))
 
+    # overdue scans: WHERE session_id = ? AND NOT completed AND due_ts < now,
+    # an index range read over open reminders only
+    __table_args__ = (
+        Index(
+            "ix_reminders_session_open_due", "session_id", "due_ts",
+            postgresql_where=completed.is_(False), sqlite_where=completed.is_(False),
+        ),
+    )
+
 
 class CheckIn(Base):
     """User check-ins"""
     __tablename__ = "checkins"
     
     id = Column(String(255), primary_key=True)
-    session_id = Column(String(255), index=True, nullable=False)
+    session_id = Column(String(255), ForeignKey("sessions.id", ondelete="CASCADE"), index=True, nullable=False)
     mood = Column(String(100), nullable=False)
     energy = Column(Integer, nullable=False)
     focus = Column(Integer, nullable=False)
     note = Column(Text, default="")
     ts = Column(DateTime, default=lambda: datetime.now(timezone.utc))
 
+    __table_args__ = (Index("ix_checkins_session_ts", "session_id", ts.desc()),)
+
 
 class OutboundMessage(Base):
     """Outbox queue for message delivery"""
     __tablename__ = "outbound_messages"
     
     id = Column(String(255), primary_key=True)
-    session_id = Column(String(255), index=True, nullable=False)
+    session_id = Column(String(255), ForeignKey("sessions.id", ondelete="CASCADE"), index=True, nullable=False)
     text = Column(Text, nullable=False)
     reason = Column(String(100), nullable=False)
     ts = Column(DateTime, default=lambda: datetime.now(timezone.utc))
     delivered = Column(Boolean, default=False)
     attempts = Column(Integer, default=0)
 
+    __table_args__ = (
+        Index("ix_outbound_messages_session_ts", "session_id", ts.desc()),
+        # pending-delivery reads: WHERE session_id = ? AND NOT delivered ORDER BY ts
+        Index(
+            "ix_outbound_messages_session_pending", "session_id", "ts",
+            postgresql_where=delivered.is_(False), sqlite_where=delivered.is_(False),
+        ),
+    )
+
 
 class InboundMessage(Base):
     """Inbound messages from external platforms"""
     __tablename__ = "inbound_messages"
     
     id = Column(String(255), primary_key=True)
-    session_id = Column(String(255), index=True, nullable=False)
+    session_id = Column(String(255), ForeignKey("sessions.id", ondelete="CASCADE"), index=True, nullable=False)
     source = Column(String(50), nullable=False)
     author = Column(String(255), nullable=False)
     text = Column(Text, nullable=False)
     ts = Column(DateTime, default=lambda: datetime.now(timezone.utc))
-    raw = Column(JSON, default={})
+    raw = Column(JSON().with_variant(JSONB(), "postgresql"), default={})
+
+    __table_args__ = (Index("ix_inbound_messages_session_ts", "session_id", ts.desc()),)
 
 
 def get_engine():
@@ -100,7 +133,17 @@ def get_engine():
     database_url = os.getenv("DATABASE_URL")
     if not database_url:
         raise ValueError("DATABASE_URL not set in environment")
-    return create_engine(database_url, echo=False)  # Set to False for production
+    kwargs = {}
+    if HAS_ORJSON:
+        kwargs["json_serializer"] = lambda v: orjson.dumps(v).decode()
+        kwargs["json_deserializer"] = orjson.loads
+    # Optional: DB_SYNCHRONOUS_COMMIT=off acknowledges commits before the WAL
+    # flush; a crash can lose the last few hundred ms of writes but never
+    # corrupts data. Unset keeps the server default (on).
+    sync_commit = os.getenv("DB_SYNCHRONOUS_COMMIT")
+    if sync_commit and database_url.startswith("postgresql"):
+        kwargs["connect_args"] = {"options": f"-c synchronous_commit={sync_commit}"}
+    return create_engine(database_url, echo=False, **kwargs)  # Set to False for production
 
 
 def get_session_factory():
@@ -113,8 +156,33 @@ def init_db():
     """Initialize database tables"""
     engine = get_engine()
     Base.metadata.create_all(engine)
+    _add_missing_session_fks(engine)
     print("✅ Database tables created successfully")
 
 
+def _add_missing_session_fks(engine):
+    """Add the session_id ON DELETE CASCADE FKs to tables created before them.
+
+    create_all never alters existing tables. NOT VALID skips checking old
+    rows (any orphans stay put); new rows and session deletes are covered.
+    """
+    if engine.dialect.name != "postgresql":
+        return
+    insp = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if table.name == Session.__tablename__ or "session_id" not in table.c:
+                continue
+            fks = insp.get_foreign_keys(table.name)
+            if any(fk["referred_table"] == Session.__tablename__ for fk in fks):
+                continue
+            conn.execute(text(
+                f"ALTER TABLE {table.name} ADD CONSTRAINT fk_{table.name}_session_id "
+                f"FOREIGN KEY (session_id) REFERENCES {Session.__tablename__}(id) "
+                "ON DELETE CASCADE NOT VALID"
+            ))
+            print(f"✅ Added session_id cascade FK to {table.name}")
+
+
 if __name__ == "__main__":
     init_db()
@@ -0,0 +1,39 @@
+# app/outbox_events.py
+import asyncio
+import threading
+from typing import Dict, List, Tuple
+
+# In-process fan-out of newly queued outbox rows to /outbox/stream listeners.
+# Rows are published from sync endpoints (threadpool) as well as from the
+# event loop, so each queue is fed through its own loop's call_soon_threadsafe.
+_subscribers: Dict[str, List[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = {}
+_lock = threading.Lock()
+
+
+def subscribe(session_id: str) -> asyncio.Queue:
+    """Return a queue that receives every outbox row added for the session."""
+    queue: asyncio.Queue = asyncio.Queue()
+    with _lock:
+        _subscribers.setdefault(session_id, []).append((asyncio.get_running_loop(), queue))
+    return queue
+
+
+def unsubscribe(session_id: str, queue: asyncio.Queue) -> None:
+    with _lock:
+        subs = [s for s in _subscribers.get(session_id, []) if s[1] is not queue]
+        if subs:
+            _subscribers[session_id] = subs
+        else:
+            _subscribers.pop(session_id, None)
+
+
+def publish(session_id: str, row: dict) -> None:
+    """Hand a committed outbox row to the session's listeners, if any."""
+    with _lock:
+        subs = list(_subscribers.get(session_id, ()))
+    for loop, queue in subs:
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, row)
+        except RuntimeError:
+            # listener's loop already closed; unsubscribe happens in its finally
+            pass
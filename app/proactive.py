@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from datetime import datetime, timezone
+from datetime import datetime, time, timedelta, timezone
 import os
 from zoneinfo import ZoneInfo
 from typing import Optional
@@ -8,8 +8,6 @@ from typing import Optional
 from app import memory
 
 # Proactive outreach helper (Day 6)
-# Uses the in-memory `store` where available. The code is defensive when
-# optional APIs are not present: it will treat missing lists as empty.
 
 
 def proactive_prompt(session_id: str) -> Optional[str]:
@@ -25,9 +23,8 @@ def proactive_prompt(session_id: str) -> Optional[str]:
       else return None
 
     Notes:
-      - This function expects the global `store` in `app.memory` to provide
-        `list_checkins`, `list_reminders`, and `list_tasks`. If any are missing
-        the function treats them as empty lists (non-fatal).
+      - All inputs come from one `store.proactive_state` query (counts and an
+        EXISTS in SQL), so the cost does not grow with the session's history.
 
     Minimal self-check examples (expected outputs):
       #1 No check-ins at all -> returns greeting string
@@ -38,112 +35,36 @@ def proactive_prompt(session_id: str) -> Optional[str]:
     store = memory.store
     now = datetime.now(timezone.utc)
 
-    # 0) GUARD: check if user replied within last 6 hours
-    last_activity_ts = store.get_last_user_activity(session_id=session_id)
-    if last_activity_ts:
-        try:
-            last_activity_dt = datetime.fromisoformat(last_activity_ts)
-            if last_activity_dt.tzinfo is None:
-                last_activity_dt = last_activity_dt.replace(tzinfo=timezone.utc)
-            time_since_activity = (now - last_activity_dt).total_seconds()
-            if time_since_activity < 6 * 3600:  # 6 hours in seconds
-                # User replied recently; skip proactive outreach
-                return None
-        except Exception:
-            pass
-
-    # 1) check-ins: if no check-in for today's local date, prompt user
-    try:
-        checkins = store.list_checkins(session_id=session_id)
-    except AttributeError:
-        checkins = []
-
-    # determine if any checkin exists with local date == today in APP_TZ
+    # Today's bounds in APP_TZ, computed once; the check-in test runs in the DB
     app_tz_name = os.getenv("APP_TZ", "America/New_York")
     try:
         tz = ZoneInfo(app_tz_name)
     except Exception:
         tz = ZoneInfo("America/New_York")
-    today_local = datetime.now(tz).date()
-    has_today = False
-    for c in checkins:
-        ts = None
-        if isinstance(c, dict):
-            ts = c.get("ts")
-        else:
-            ts = getattr(c, "ts", None)
-        if not ts:
-            continue
-        try:
-            c_dt = datetime.fromisoformat(ts)
-        except Exception:
-            continue
-        if c_dt.tzinfo is None:
-            # assume UTC if no tz
-            c_dt = c_dt.replace(tzinfo=timezone.utc)
-        # convert to configured APP_TZ then compare date
-        try:
-            local_date = c_dt.astimezone(tz).date()
-        except Exception:
-            local_date = c_dt.date()
-        if local_date == today_local:
-            has_today = True
-            break
-
-    if not has_today:
-        return "Quick check-in: mood? energy (1-10)? focus (1-10)?"
+    today_local = now.astimezone(tz).date()
+    day_start = datetime.combine(today_local, time.min, tzinfo=tz)
+    day_end = datetime.combine(today_local + timedelta(days=1), time.min, tzinfo=tz)
 
-    # 2) reminders overdue
-    overdue_count = 0
-    try:
-        reminders = store.list_reminders(session_id=session_id)
-    except AttributeError:
-        reminders = []
-
-    for r in reminders:
-        # support both dict-like and attr-like objects
-        due_ts = None
-        completed = False
-        if isinstance(r, dict):
-            due_ts = r.get("due_ts") or r.get("due")
-            completed = r.get("completed", False)
-        else:
-            due_ts = getattr(r, "due_ts", None) or getattr(r, "due", None)
-            completed = getattr(r, "completed", False)
-
-        if not due_ts:
-            continue
-        try:
-            due_dt = datetime.fromisoformat(due_ts)
-        except Exception:
-            # ignore unparsable timestamps
-            continue
-
-        # ensure tz-aware comparison
-        if due_dt.tzinfo is None:
-            due_dt = due_dt.replace(tzinfo=timezone.utc)
-
-        if (due_dt < now) and (not completed):
-            overdue_count += 1
+    # One query for everything below
+    state = store.proactive_state(session_id, day_start, day_end, now)
 
+    # 0) GUARD: check if user replied within last 6 hours
+    last_activity = state["last_activity"]
+    if last_activity and (now - last_activity).total_seconds() < 6 * 3600:  # 6 hours in seconds
+        # User replied recently; skip proactive outreach
+        return None
+
+    # 1) check-ins: if no check-in for today's local date, prompt user
+    if not state["has_checkin_today"]:
+        return "Quick check-in: mood? energy (1-10)? focus (1-10)?"
+
+    # 2) reminders overdue (due_ts < now UTC and not completed)
+    overdue_count = state["overdue_reminders"]
     if overdue_count > 0:
         return f"You have {overdue_count} overdue reminders. Want to review them?"
 
     # 3) open tasks >= 3
-    try:
-        tasks = store.list_tasks(session_id=session_id)
-    except AttributeError:
-        tasks = []
-
-    open_tasks = 0
-    for t in tasks:
-        if isinstance(t, dict):
-            completed = t.get("completed", False)
-        else:
-            completed = getattr(t, "completed", False)
-        if not completed:
-            open_tasks += 1
-
+    open_tasks = state["open_tasks"]
     if open_tasks >= 3:
         return f"You have {open_tasks} open tasks. Want to pick one to focus on?"
 
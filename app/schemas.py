@@ -1,11 +1,34 @@
-from pydantic import BaseModel, Field
-from typing import Optional, Dict, Any
+from fastapi import Request
+from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel, Field, ValidationError
+from typing import Optional, Dict, Any, List
 
 class ChatRequest(BaseModel):
     message: str = Field(..., min_length=1, description="User input message")
     session_id: Optional[str] = Field(None, description="Client-provided session id (optional)")
     metadata: Dict[str, Any] = Field(default_factory=dict, description="Extra client context")
 
+async def parse_chat_request(request: Request) -> ChatRequest:
+    """Validate the /chat body straight from bytes with pydantic-core's JSON parser.
+
+    Skips FastAPI's json.loads + dict validation pass; errors are still a 422.
+    """
+    try:
+        return ChatRequest.model_validate_json(await request.body())
+    except ValidationError as e:
+        raise RequestValidationError(
+            [{**err, "loc": ("body", *err["loc"])} for err in e.errors(include_url=False)]
+        )
+
+
+# parse_chat_request reads the raw body, so document it for /docs explicitly
+CHAT_REQUEST_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {"application/json": {"schema": ChatRequest.model_json_schema()}},
+    }
+}
+
 class ChatResponse(BaseModel):
     request_id: str
     session_id: str
@@ -39,4 +62,8 @@ class DiscordInboundEvent(BaseModel):
 
 class BindDiscordChannelRequest(BaseModel):
     session_id: str = Field(..., description="Session ID to bind")
-    channel_id: str = Field(..., description="Discord channel ID to bind")
\ No newline at end of file
+    channel_id: str = Field(..., description="Discord channel ID to bind")
+
+
+class BulkDeliverRequest(BaseModel):
+    ids: List[str] = Field(..., description="Outbox message IDs that were delivered")
\ No newline at end of file
@@ -0,0 +1,73 @@
+# app/semantic_cache.py
+from collections import OrderedDict
+import threading
+from typing import Optional, Tuple
+
+# Optional dependencies; the cache stays disabled unless both are installed
+try:
+    from sentence_transformers import SentenceTransformer
+    HAS_SENTENCE_TRANSFORMERS = True
+except ImportError:
+    HAS_SENTENCE_TRANSFORMERS = False
+
+try:
+    import hnswlib
+    HAS_HNSWLIB = True
+except ImportError:
+    HAS_HNSWLIB = False
+
+
+class SemanticCache:
+    """Nearest-neighbour reply cache over sentence embeddings.
+
+    Replies are looked up by cosine similarity of the user message embedding;
+    the oldest entries are evicted once `max_entries` is reached.
+    """
+
+    def __init__(
+        self,
+        model_name: str = "all-MiniLM-L6-v2",
+        threshold: float = 0.87,
+        max_entries: int = 10_000,
+    ):
+        self.model_name = model_name
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._model = None
+        self._index = None
+        self._replies: "OrderedDict[int, str]" = OrderedDict()  # label -> reply, oldest first
+        self._next_label = 0
+        self._lock = threading.Lock()
+
+    def _ensure_loaded(self) -> None:
+        # Loading the model is slow, so defer it to the first lookup
+        if self._model is None:
+            self._model = SentenceTransformer(self.model_name)
+            dim = self._model.get_sentence_embedding_dimension()
+            index = hnswlib.Index(space="cosine", dim=dim)
+            index.init_index(max_elements=self.max_entries, allow_replace_deleted=True)
+            self._index = index
+
+    def lookup(self, text: str) -> Tuple[Optional[str], object]:
+        """Return (cached reply or None, embedding); pass the embedding to `add` on a miss."""
+        with self._lock:
+            self._ensure_loaded()
+            emb = self._model.encode(text, normalize_embeddings=True)
+            if not self._replies:
+                return None, emb
+            labels, dists = self._index.knn_query(emb, k=1)
+            label = int(labels[0][0])
+            if 1 - dists[0][0] >= self.threshold and label in self._replies:
+                self._replies.move_to_end(label)
+                return self._replies[label], emb
+            return None, emb
+
+    def add(self, emb, reply: str) -> None:
+        with self._lock:
+            if len(self._replies) >= self.max_entries:
+                oldest, _ = self._replies.popitem(last=False)
+                self._index.mark_deleted(oldest)
+            label = self._next_label
+            self._next_label += 1
+            self._index.add_items(emb, [label], replace_deleted=True)
+            self._replies[label] = reply
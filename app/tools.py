@@ -7,11 +7,11 @@ def add_task_tool(session_id: str, args: Dict[str, Any]):
     if not title:
         return {"ok": False, "error": "Missing task title"}
     task = store.add_task(session_id, title)
-    return {"ok": True, "task": task.__dict__}
+    return {"ok": True, "task": task}
 
 def list_tasks_tool(session_id: str, args: Dict[str, Any]):
     tasks = store.list_tasks(session_id)
-    return {"tasks": [t.__dict__ for t in tasks]}
+    return {"tasks": tasks}
 
 def complete_task_tool(session_id: str, args: Dict[str, Any]):
     task_id = args.get("task_id")
@@ -36,12 +36,12 @@ def add_reminder_tool(session_id: str, args: Dict[str, Any]):
             return {"ok": False, "error": "Invalid minutes"}
 
     reminder = store.add_reminder(session_id, text=text, due_ts=due_ts)
-    return {"ok": True, "reminder": reminder.__dict__}
+    return {"ok": True, "reminder": reminder}
 
 
 def list_reminders_tool(session_id: str, args: Dict[str, Any]):
     reminders = store.list_reminders(session_id)
-    return {"reminders": [r.__dict__ for r in reminders]}
+    return {"reminders": reminders}
 
 
 def complete_reminder_tool(session_id: str, args: Dict[str, Any]):
@@ -58,17 +58,11 @@ def check_in_tool(session_id: str, args: Dict[str, Any]):
     focus = int(args.get("focus", 5))
     note = args.get("note", "")
     chk = store.add_checkin(session_id, mood=mood, energy=energy, focus=focus, note=note)
-    return {"ok": True, "checkin": chk.__dict__}
+    return {"ok": True, "checkin": chk}
 
 
 def today_summary_tool(session_id: str, args: Dict[str, Any]):
-    tasks = store.list_tasks(session_id)
-    reminders = store.list_reminders(session_id)
-    checkins = store.list_checkins(session_id, limit=1)
-    open_tasks = sum(1 for t in tasks if not t.completed)
-    open_reminders = sum(1 for r in reminders if not r.completed)
-    last_checkin = checkins[-1].__dict__ if checkins else None
-    return {"open_tasks": open_tasks, "open_reminders": open_reminders, "last_checkin": last_checkin}
+    return store.today_summary(session_id)
 
 TOOLS = {
     "add_task": add_task_tool,
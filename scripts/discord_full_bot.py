@@ -16,13 +16,14 @@ Usage:
 
 import os
 import sys
-import json
-import requests
 import logging
 import asyncio
+import random
 from typing import Optional
 
+import aiohttp
 import discord
+import orjson
 from discord.ext import commands
 
 # Configure logging
@@ -32,6 +33,10 @@ logging.basicConfig(
 )
 logger = logging.getLogger("discord_full_bot")
 
+# Request bodies are pre-encoded with orjson and sent as data=, skipping
+# aiohttp's json.dumps-based encoder; responses are decoded the same way.
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
 
 def _env_or_error(key: str) -> str:
     """Get environment variable or exit with error."""
@@ -42,17 +47,47 @@ def _env_or_error(key: str) -> str:
     return val
 
 
+_REQUIRED_ENV = ("DISCORD_BOT_TOKEN", "API_BASE_URL", "SESSION_ID", "DISCORD_CHANNEL_ID")
+
+
+def _load_config() -> dict:
+    """Read and validate the required environment variables once."""
+    return {key: _env_or_error(key) for key in _REQUIRED_ENV}
+
+
 class DiscordFullBot(commands.Cog):
     """Combined Discord bot for listening and replying."""
 
-    def __init__(self, bot: commands.Bot):
+    def __init__(self, bot: commands.Bot, config: dict):
         self.bot = bot
-        self.bot_token = _env_or_error("DISCORD_BOT_TOKEN")
-        self.api_base_url = _env_or_error("API_BASE_URL").rstrip("/")
-        self.session_id = _env_or_error("SESSION_ID")
-        self.channel_id = _env_or_error("DISCORD_CHANNEL_ID")
+        self.api_base_url = config["API_BASE_URL"].rstrip("/")
+        self.session_id = config["SESSION_ID"]
+        self.channel_id = config["DISCORD_CHANNEL_ID"]
+        self._channel_id_int = int(self.channel_id)
+        # reply channel, resolved once; discord.py updates the object in place on edits
+        self._channel: Optional[discord.abc.Messageable] = None
         
         self.reply_task = None
+        self.http: Optional[aiohttp.ClientSession] = None
+        # delivery acks still in flight (see send_reply)
+        self._ack_tasks: set = set()
+
+    def _session(self) -> aiohttp.ClientSession:
+        """Shared keep-alive session for backend calls, so requests never block the event loop."""
+        if self.http is None or self.http.closed:
+            self.http = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=16, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=10),
+            )
+        return self.http
+
+    async def cog_unload(self):
+        """Stop polling and close the HTTP session."""
+        if self.reply_task:
+            self.reply_task.cancel()
+        await self._drain_acks()
+        if self.http is not None:
+            await self.http.close()
 
     @commands.Cog.listener()
     async def on_ready(self):
@@ -63,9 +98,28 @@ class DiscordFullBot(commands.Cog):
         else:
             logger.info("Monitoring all channels (no DISCORD_CHANNEL_ID set)")
         
+        await self._get_channel()
+
         # Start reply polling task
         self.reply_task = asyncio.create_task(self.poll_outbox())
 
+    @commands.Cog.listener()
+    async def on_guild_channel_delete(self, channel):
+        """Drop the cached reply channel if it was deleted."""
+        if channel.id == self._channel_id_int:
+            self._channel = None
+
+    async def _get_channel(self) -> Optional[discord.abc.Messageable]:
+        """Return the reply channel, looking it up (or fetching it) only when not cached."""
+        if self._channel is None:
+            self._channel = self.bot.get_channel(self._channel_id_int)
+            if self._channel is None:
+                try:
+                    self._channel = await self.bot.fetch_channel(self._channel_id_int)
+                except discord.HTTPException as e:
+                    logger.error(f"Could not fetch channel {self.channel_id}: {e}")
+        return self._channel
+
     @commands.Cog.listener()
     async def on_message(self, message: discord.Message):
         """Listen for messages and post inbound to backend."""
@@ -74,13 +128,14 @@ class DiscordFullBot(commands.Cog):
             return
 
         # Filter by channel if configured
-        if self.channel_id and str(message.channel.id) != self.channel_id:
+        if self.channel_id and message.channel.id != self._channel_id_int:
             return
 
-        # Build inbound event payload
+        # Build inbound event payload; the channel filter above means the
+        # configured id string is the message's channel id
         payload = {
-            "channel_id": str(message.channel.id),
-            "author": str(message.author.name),
+            "channel_id": self.channel_id,
+            "author": message.author.name,
             "author_id": str(message.author.id),
             "content": message.content,
             "message_id": str(message.id),
@@ -100,30 +155,19 @@ class DiscordFullBot(commands.Cog):
         url = f"{self.api_base_url}/integrations/discord/inbound"
         
         try:
-            logger.info("=" * 60)
-            logger.info("POSTING MESSAGE TO BACKEND")
-            logger.info(f"URL: {url}")
-            logger.info(f"Author: {payload['author']}")
-            logger.info(f"Content: {payload['content'][:100]}")
-            logger.info("=" * 60)
-            
-            response = requests.post(url, json=payload, timeout=10)
-            
-            logger.info(f"Backend response: {response.status_code}")
+            logger.debug("inbound url=%s author=%s len=%d", url, payload["author"], len(payload["content"]))
             
-            if response.status_code == 200:
-                data = response.json()
-                
+            async with self._session().post(url, data=orjson.dumps(payload), headers=_JSON_HEADERS) as response:
+                status = response.status
+                if status == 200:
+                    data = orjson.loads(await response.read())
+                else:
+                    body = await response.text()
+
+            if status == 200:
                 if data.get("ok"):
-                    logger.info("✓ Message accepted by backend")
-                    if data.get("ingested"):
-                        logger.info("✓ Message processed (not duplicate)")
-                    else:
-                        logger.info("⊙ Message was duplicate (already processed)")
-                    
-                    if data.get("reply_text"):
-                        logger.info(f"✓ REPLY GENERATED: {data['reply_text'][:100]}...")
-                        logger.info("  (Reply queued in outbox for delivery)")
+                    logger.debug("inbound accepted ingested=%s reply_queued=%s",
+                                 data.get("ingested"), bool(data.get("reply_text")))
                     return True
                 else:
                     error = data.get("error", "Unknown error")
@@ -133,62 +177,114 @@ class DiscordFullBot(commands.Cog):
                         logger.error("  >> Example: export DISCORD_SESSION_ID='test-session'")
                     return False
             else:
-                logger.error(f"✗ Backend HTTP error {response.status_code}")
-                logger.error(f"  Response: {response.text[:200]}")
+                logger.error(f"✗ Backend HTTP error {status}")
+                logger.error(f"  Response: {body[:200]}")
                 return False
-        except Exception as e:
-            logger.error(f"✗ Exception while posting: {e}")
-            import traceback
-            logger.error(traceback.format_exc())
+        except Exception:
+            logger.exception("✗ Exception while posting")
             return False
 
     async def poll_outbox(self):
-        """Poll backend outbox and send replies."""
-        logger.info("Starting outbox polling loop...")
-        
+        """Follow the backend outbox stream and send replies.
+
+        Falls back to one poll per reconnect attempt, with exponential
+        backoff, while the stream is unavailable.
+        """
+        logger.info("Starting outbox stream...")
+        backoff = 1
+
         while True:
+            # a (re)connect replays undelivered rows; let pending acks land first
+            await self._drain_acks()
             try:
-                # Get undelivered messages from outbox
-                response = requests.get(
-                    f"{self.api_base_url}/sessions/{self.session_id}/outbox",
-                    timeout=10
-                )
+                await self._follow_outbox_stream()
+                # server closed the stream (e.g. restart); reconnect shortly,
+                # jittered so senders don't all reconnect in the same instant
+                backoff = 1
+                await asyncio.sleep(1 + random.random())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Outbox stream error: {e}; polling, retry in {backoff}s")
+                await self._poll_outbox_once()
+                await asyncio.sleep(backoff + random.random())
+                backoff = min(backoff * 2, 60)
+
+    async def _follow_outbox_stream(self):
+        """Send each message pushed on GET /outbox/stream until it closes."""
+        async with self._session().get(
+            f"{self.api_base_url}/sessions/{self.session_id}/outbox/stream",
+            # no overall deadline; the server sends a keepalive every 15s
+            timeout=aiohttp.ClientTimeout(total=None, sock_read=60),
+        ) as response:
+            if response.status != 200:
+                raise RuntimeError(f"HTTP {response.status}")
+            logger.info("✓ Connected to outbox stream")
+            async for line in response.content:
+                if line.startswith(b"data:"):
+                    msg = orjson.loads(line[5:])
+                    if not msg.get("delivered", False):
+                        await self.send_reply(msg)
+
+    async def _poll_outbox_once(self):
+        """Fetch the outbox once and send any undelivered messages."""
+        try:
+            # Get undelivered messages from outbox
+            async with self._session().get(
+                f"{self.api_base_url}/sessions/{self.session_id}/outbox",
+                params={"delivered": "false", "limit": "50"},
+            ) as response:
+                status = response.status
+                data = orjson.loads(await response.read()) if status == 200 else None
+            
+            if status == 200:
+                outbox = data.get("outbox", [])
                 
-                if response.status_code == 200:
-                    data = response.json()
-                    outbox = data.get("outbox", [])
-                    
-                    # Find undelivered messages
-                    undelivered = [msg for msg in outbox if not msg.get("delivered", False)]
+                # the backend filters already; also guards against one that ignores ?delivered
+                undelivered = [msg for msg in outbox if not msg.get("delivered", False)]
+                
+                if undelivered:
+                    logger.debug("outbox undelivered=%d", len(undelivered))
                     
-                    if undelivered:
-                        logger.info(f"Found {len(undelivered)} undelivered messages")
+                    # send in order, then acknowledge them all in one call
+                    delivered = []
+                    for msg in undelivered:
+                        if await self._send_to_channel(msg):
+                            delivered.append(msg["id"])
+                    await self._ack_delivered(delivered)
                         
-                        for msg in undelivered:
-                            await self.send_reply(msg)
-                            
-                else:
-                    logger.error(f"Failed to get outbox: {response.status_code}")
-                
-                # Wait before next poll
-                await asyncio.sleep(3)
-                
-            except Exception as e:
-                logger.error(f"Error in polling loop: {e}")
-                await asyncio.sleep(5)
+            else:
+                logger.error(f"Failed to get outbox: {status}")
+            
+        except Exception as e:
+            logger.error(f"Error polling outbox: {e}")
 
     async def send_reply(self, msg: dict):
-        """Send a reply message to Discord."""
+        """Send a reply message to Discord and mark it delivered.
+
+        Sends stay sequential so replies keep their order in the channel; the
+        ack runs in the background, overlapping the next message's send.
+        """
+        if await self._send_to_channel(msg):
+            task = asyncio.create_task(self._ack_delivered([msg["id"]]))
+            self._ack_tasks.add(task)
+            task.add_done_callback(self._ack_tasks.discard)
+
+    async def _drain_acks(self):
+        if self._ack_tasks:
+            await asyncio.gather(*self._ack_tasks, return_exceptions=True)
+
+    async def _send_to_channel(self, msg: dict) -> bool:
+        """Post an outbox message to the channel; True once Discord accepted it."""
         try:
             text = msg.get("text", "").strip()
             if not text:
                 logger.warning("Empty message, skipping")
-                return
+                return False
 
-            logger.info(f"Sending reply: {text[:60]}...")
+            logger.debug("sending reply len=%d", len(text))
             
-            # Get the channel (use bot.get_channel, not self.bot.get_channel)
-            channel = self.bot.get_channel(int(self.channel_id))
+            channel = await self._get_channel()
             if not channel:
                 logger.error(f"Could not find channel {self.channel_id}")
                 # Debug: List all channels the bot can see
@@ -197,36 +293,51 @@ class DiscordFullBot(commands.Cog):
                     logger.info(f"  Guild: {guild.name}")
                     for ch in guild.text_channels:
                         logger.info(f"    - {ch.name} (ID: {ch.id})")
-                return
+                return False
             
             # Send message to Discord
-            discord_msg = await channel.send(text)
-            
-            # Mark as delivered in backend
-            response = requests.patch(
-                f"{self.api_base_url}/sessions/{self.session_id}/outbox/{msg['id']}",
-                json={"delivered": True, "delivered_at": discord_msg.created_at.isoformat()},
-                timeout=10
-            )
-            
-            if response.status_code == 200:
-                logger.info(f"✓ Reply sent and marked as delivered")
-            else:
-                logger.error(f"Failed to mark as delivered: {response.status_code}")
+            await channel.send(text)
+            return True
                 
         except Exception as e:
             logger.error(f"Error sending reply: {e}")
+            return False
+
+    async def _ack_delivered(self, ids: list):
+        """Mark sent messages delivered in the backend, in one request when it can."""
+        if not ids:
+            return
+        base = f"{self.api_base_url}/sessions/{self.session_id}/outbox"
+        try:
+            async with self._session().post(
+                f"{base}/bulk_deliver", data=orjson.dumps({"ids": ids}), headers=_JSON_HEADERS
+            ) as response:
+                status = response.status
+
+            if status in (404, 405):
+                # older backend without the bulk endpoint: overlap single PATCHes
+                statuses = await asyncio.gather(*(self._patch_delivered(f"{base}/{i}") for i in ids))
+                status = next((st for st in statuses if st != 200), 200)
+
+            if status == 200:
+                logger.debug("outbox delivered=%d", len(ids))
+            else:
+                logger.error(f"Failed to mark as delivered: {status}")
+
+        except Exception as e:
+            logger.error(f"Error marking delivered: {e}")
 
+    async def _patch_delivered(self, url: str) -> int:
+        async with self._session().patch(url, data=orjson.dumps({"delivered": True}), headers=_JSON_HEADERS) as response:
+            return response.status
 
 async def main():
     """Initialize and run the bot."""
-    bot_token = _env_or_error("DISCORD_BOT_TOKEN")
-    api_base_url = _env_or_error("API_BASE_URL")
-    session_id = _env_or_error("SESSION_ID")
+    config = _load_config()
 
     logger.info(f"Starting Discord Full Bot")
-    logger.info(f"API Base URL: {api_base_url}")
-    logger.info(f"Session ID: {session_id}")
+    logger.info(f"API Base URL: {config['API_BASE_URL']}")
+    logger.info(f"Session ID: {config['SESSION_ID']}")
 
     # Create bot with minimal intents + message content
     intents = discord.Intents.default()
@@ -236,11 +347,11 @@ async def main():
     bot = commands.Bot(command_prefix="!", intents=intents)
 
     # Add the cog
-    await bot.add_cog(DiscordFullBot(bot))
+    await bot.add_cog(DiscordFullBot(bot, config))
 
     # Start the bot
     try:
-        await bot.start(bot_token)
+        await bot.start(config["DISCORD_BOT_TOKEN"])
     except KeyboardInterrupt:
         logger.info("Shutting down...")
         await bot.close()
@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 """
-Discord Poller — Fetches new Discord messages and POSTs them to /integrations/discord/ingest
+Discord Poller — Receives new Discord messages over the Gateway and POSTs them to /integrations/discord/ingest
 
 Environment Variables:
   DISCORD_BOT_TOKEN (required): Discord bot token
@@ -8,20 +8,35 @@ Environment Variables:
   SESSION_ID (required): Session ID for ingest endpoint
   BASE_URL (optional, default: http://127.0.0.1:8000): Backend URL
   DISCORD_ALLOWED_USER_ID (optional): Filter to single user
-  STATE_FILE (optional, default: .discord_last_seen.json): Persist last seen message ID
+
+Runs until stopped. On start, the channel's last 10 messages are ingested once
+(the backend dedups by message_id); after that MESSAGE_CREATE events are pushed
+by the Discord Gateway. Short disconnects are resumed without a gap; when a new
+Gateway session is needed, messages after the last one seen are fetched with
+?after= first.
 
 Usage:
   python scripts/discord_poller.py
 """
 
 import os
-import json
+import random
 import sys
-import urllib.request
-import urllib.error
-import urllib.parse
-from datetime import datetime, timezone
-from pathlib import Path
+import asyncio
+
+import orjson
+import urllib3
+import websockets
+
+# Shared keep-alive pool: repeat calls to discord.com and to the backend reuse
+# their TCP/TLS connections instead of handshaking per request.
+POOL = urllib3.PoolManager(num_pools=4, maxsize=8, block=False)
+
+GATEWAY_URL = "wss://gateway.discord.gg/?v=10&encoding=json"
+# GUILD_MESSAGES | MESSAGE_CONTENT
+GATEWAY_INTENTS = (1 << 9) | (1 << 15)
+# Close codes after which reconnecting cannot help (bad token, bad intents, ...)
+FATAL_CLOSE_CODES = {4004, 4010, 4011, 4012, 4013, 4014}
 
 def _env_or_error(key: str) -> str:
     """Get environment variable or exit with error."""
@@ -32,43 +47,22 @@ def _env_or_error(key: str) -> str:
     return val
 
 
-def _load_last_seen(state_file: str) -> str | None:
-    """Load last seen message ID from state file."""
-    try:
-        if os.path.exists(state_file):
-            with open(state_file, "r") as f:
-                data = json.load(f)
-                return data.get("last_seen_id")
-    except Exception as e:
-        print(f"[WARN] Failed to load state file: {e}", file=sys.stderr)
-    return None
-
-
-def _save_last_seen(state_file: str, message_id: str) -> None:
-    """Save last seen message ID to state file."""
-    try:
-        with open(state_file, "w") as f:
-            json.dump({"last_seen_id": message_id}, f)
-    except Exception as e:
-        print(f"[WARN] Failed to save state file: {e}", file=sys.stderr)
-
-
-def _fetch_discord_messages(bot_token: str, channel_id: str, limit: int = 10) -> list:
-    """Fetch recent messages from Discord channel."""
+def _fetch_discord_messages(bot_token: str, channel_id: str, limit: int = 10, after: str | None = None) -> list:
+    """Fetch recent messages from Discord channel, or only those newer than `after`."""
     url = f"https://discord.com/api/v10/channels/{channel_id}/messages?limit={limit}"
+    if after:
+        url += f"&after={after}"
     headers = {
         "Authorization": f"Bot {bot_token}",
         "User-Agent": "discord-poller/1.0",
     }
     
     try:
-        req = urllib.request.Request(url, headers=headers)
-        with urllib.request.urlopen(req, timeout=10) as response:
-            data = response.read().decode("utf-8")
-            return json.loads(data)
-    except urllib.error.HTTPError as e:
-        print(f"[ERROR] Discord API error: {e.code} {e.reason}", file=sys.stderr)
-        return []
+        response = POOL.request("GET", url, headers=headers, timeout=10)
+        if response.status >= 400:
+            print(f"[ERROR] Discord API error: {response.status} {response.reason}", file=sys.stderr)
+            return []
+        return orjson.loads(response.data)
     except Exception as e:
         print(f"[ERROR] Failed to fetch Discord messages: {e}", file=sys.stderr)
         return []
@@ -80,122 +74,238 @@ def _post_ingest(base_url: str, payload: dict) -> dict | None:
     headers = {"Content-Type": "application/json"}
     
     try:
-        data = json.dumps(payload).encode("utf-8")
-        req = urllib.request.Request(url, data=data, headers=headers, method="POST")
-        with urllib.request.urlopen(req, timeout=10) as response:
-            result = response.read().decode("utf-8")
-            return json.loads(result)
-    except urllib.error.HTTPError as e:
-        print(f"[ERROR] Ingest endpoint error: {e.code} {e.reason}", file=sys.stderr)
-        return None
+        data = orjson.dumps(payload)
+        response = POOL.request("POST", url, body=data, headers=headers, timeout=10)
+        if response.status >= 400:
+            print(f"[ERROR] Ingest endpoint error: {response.status} {response.reason}", file=sys.stderr)
+            return None
+        return orjson.loads(response.data)
     except Exception as e:
         print(f"[ERROR] Failed to POST ingest: {e}", file=sys.stderr)
         return None
 
 
+def _snowflake_key(msg_id: str) -> tuple:
+    """Sort key ordering snowflake id strings numerically without int().
+
+    Snowflakes have no leading zeros, so a longer id is newer and equal-length
+    ids compare correctly as strings.
+    """
+    return len(msg_id), msg_id
+
+
+def _make_ingest_filter(allowed_user_id: str | None):
+    """Build the per-message filter that skips bot, filtered-out and empty messages.
+
+    The allowed-user check is only compiled in when a user filter is set.
+    """
+    def author_ok(msg: dict) -> bool:
+        if msg.get("author", {}).get("bot"):
+            print(f"[SKIP] bot message {msg.get('id')}")
+            return False
+        return True
+
+    def content_ok(msg: dict) -> bool:
+        if not msg.get("content", "").strip():
+            print(f"[SKIP] empty content in message {msg.get('id')}")
+            return False
+        return True
+
+    if not allowed_user_id:
+        return lambda msg: author_ok(msg) and content_ok(msg)
+
+    def user_ok(msg: dict) -> bool:
+        author_id = msg.get("author", {}).get("id")
+        if author_id != allowed_user_id:
+            print(f"[SKIP] unauthorized user {author_id} in message {msg.get('id')}")
+            return False
+        return True
+
+    return lambda msg: author_ok(msg) and user_ok(msg) and content_ok(msg)
+
+
+def _ingest_message(base_url: str, session_id: str, channel_id: str, msg: dict) -> None:
+    """POST one Discord message to the ingest endpoint and log the outcome."""
+    msg_id = msg.get("id")
+    author_name = msg.get("author", {}).get("username", "unknown")
+
+    # POST to ingest endpoint
+    payload = {
+        "session_id": session_id,
+        "channel_id": channel_id,
+        "message_id": msg_id,
+        "author": author_name,
+        "content": msg.get("content", "").strip(),
+        "ts": msg.get("timestamp"),
+    }
+
+    print(f"[INGEST] message_id={msg_id} author={author_name}")
+    result = _post_ingest(base_url, payload)
+
+    if result:
+        deduped = result.get("deduped", False)
+        queued = result.get("queued_reply", False)
+        if deduped:
+            print(f"[INFO] message_id={msg_id} was already ingested")
+        elif queued:
+            reply = result.get("reply_text", "")
+            print(f"[INFO] message_id={msg_id} reply queued: {reply[:60]}...")
+        else:
+            print(f"[INFO] message_id={msg_id} ingested (no reply)")
+    else:
+        print(f"[ERROR] failed to ingest message_id={msg_id}")
+
+
+async def _heartbeat(ws, interval_s: float, state: dict) -> None:
+    """Send op 1 heartbeats every interval; the first one is jittered per the Gateway docs."""
+    await asyncio.sleep(interval_s * random.random())
+    try:
+        while True:
+            await ws.send(orjson.dumps({"op": 1, "d": state["seq"]}).decode())
+            await asyncio.sleep(interval_s)
+    except websockets.ConnectionClosed:
+        # the receive loop sees the close and reconnects
+        pass
+
+
+async def _gateway_session(bot_token: str, state: dict, on_message, on_ready) -> None:
+    """Run one Gateway connection: identify (or resume), then dispatch until it closes."""
+    url = state["resume_url"] if state["session_id"] else GATEWAY_URL
+    async with websockets.connect(url, max_size=None) as ws:
+        hello = orjson.loads(await ws.recv())
+        heartbeat = asyncio.create_task(_heartbeat(ws, hello["d"]["heartbeat_interval"] / 1000, state))
+        try:
+            if state["session_id"]:
+                await ws.send(orjson.dumps({"op": 6, "d": {
+                    "token": bot_token, "session_id": state["session_id"], "seq": state["seq"],
+                }}).decode())
+            else:
+                await ws.send(orjson.dumps({"op": 2, "d": {
+                    "token": bot_token,
+                    "intents": GATEWAY_INTENTS,
+                    "properties": {"os": sys.platform, "browser": "discord-poller", "device": "discord-poller"},
+                }}).decode())
+
+            async for raw in ws:
+                # every guild event passes through here; decode with orjson
+                event = orjson.loads(raw)
+                op = event["op"]
+                if event.get("s") is not None:
+                    state["seq"] = event["s"]
+
+                if op == 0:
+                    if event["t"] == "READY":
+                        state["up"] = True
+                        state["session_id"] = event["d"]["session_id"]
+                        state["resume_url"] = event["d"]["resume_gateway_url"] + "/?v=10&encoding=json"
+                        print(f"[INFO] Gateway ready as {event['d']['user']['username']}")
+                        # a new session replays nothing; fetch what was missed
+                        await on_ready()
+                    elif event["t"] == "RESUMED":
+                        state["up"] = True
+                        print("[INFO] Gateway session resumed")
+                    elif event["t"] == "MESSAGE_CREATE":
+                        await on_message(event["d"])
+                elif op == 1:
+                    await ws.send(orjson.dumps({"op": 1, "d": state["seq"]}).decode())
+                elif op == 7:
+                    print("[INFO] Gateway asked to reconnect")
+                    return
+                elif op == 9:
+                    print("[WARN] Gateway session invalidated", file=sys.stderr)
+                    if not event["d"]:
+                        state["session_id"] = None
+                        state["seq"] = None
+                    await asyncio.sleep(1 + 4 * random.random())
+                    return
+        finally:
+            heartbeat.cancel()
+
+
+async def _run_gateway(bot_token: str, channel_id: str, on_message, on_ready) -> None:
+    """Keep a Gateway session open, resuming or re-identifying after disconnects."""
+    state = {"session_id": None, "resume_url": None, "seq": None, "up": False}
+
+    async def dispatch(msg: dict) -> None:
+        if msg.get("channel_id") == channel_id:
+            await on_message(msg)
+
+    backoff = 1
+    while True:
+        try:
+            await _gateway_session(bot_token, state, dispatch, on_ready)
+            # the Gateway asked for a reconnect (op 7/9); do it right away
+            backoff = 1
+            continue
+        except websockets.ConnectionClosed as e:
+            code = e.rcvd.code if e.rcvd else None
+            if code in FATAL_CLOSE_CODES:
+                print(f"[ERROR] Gateway closed with code {code}; not reconnecting", file=sys.stderr)
+                sys.exit(1)
+            reason = f"[WARN] Gateway connection closed (code={code})"
+        except (websockets.WebSocketException, OSError) as e:
+            # includes failed handshakes, e.g. a 5xx or rate-limited upgrade
+            reason = f"[ERROR] Gateway connection failed: {e}"
+        # a session that reached READY/RESUMED was healthy; start over at 1s
+        if state.pop("up", False):
+            backoff = 1
+        print(f"{reason}; retry in {backoff}s", file=sys.stderr)
+        await asyncio.sleep(backoff + random.random())
+        backoff = min(backoff * 2, 60)
+
+
 def main():
-    """Main poller loop."""
+    """Backfill recent messages, then ingest new ones as the Gateway pushes them."""
     bot_token = _env_or_error("DISCORD_BOT_TOKEN")
     channel_id = _env_or_error("DISCORD_CHANNEL_ID")
     session_id = _env_or_error("SESSION_ID")
     
     base_url = os.getenv("BASE_URL", "http://127.0.0.1:8000").rstrip("/")
-    state_file = os.getenv("STATE_FILE", ".discord_last_seen.json")
     allowed_user_id = os.getenv("DISCORD_ALLOWED_USER_ID")
     
     print(f"[START] Discord poller: channel={channel_id}, session={session_id}")
     
-    # Load last seen message ID
-    last_seen_id = _load_last_seen(state_file)
-    if last_seen_id:
-        print(f"[INFO] Resuming from message_id={last_seen_id}")
-    
-    # Fetch recent messages
+    should_ingest = _make_ingest_filter(allowed_user_id)
+
+    # Newest channel message id handled so far; anchors the ?after= catch-ups
+    last = {"id": None}
+
+    def handle(msg: dict) -> None:
+        """Ingest each channel message once, in snowflake order."""
+        msg_id = msg["id"]
+        if last["id"] is not None and _snowflake_key(msg_id) <= _snowflake_key(last["id"]):
+            return
+        last["id"] = msg_id
+        if should_ingest(msg):
+            _ingest_message(base_url, session_id, channel_id, msg)
+
+    def catch_up() -> None:
+        """Ingest every message after the anchor, a page of 100 at a time."""
+        while True:
+            batch = _fetch_discord_messages(bot_token, channel_id, limit=100, after=last["id"])
+            for msg in sorted(batch, key=lambda m: _snowflake_key(m["id"])):
+                handle(msg)
+            if len(batch) < 100:
+                return
+
+    # Backfill recent messages sent while we were not running (newest first from the API)
     messages = _fetch_discord_messages(bot_token, channel_id, limit=10)
-    if not messages:
-        print("[INFO] No messages fetched")
-        return
-    
-    print(f"[INFO] Fetched {len(messages)} messages")
-    
-    # Process messages (newest first, but we want oldest first for processing)
-    messages_to_process = []
+    print(f"[INFO] Fetched {len(messages)} recent messages")
     for msg in reversed(messages):
-        msg_id = msg.get("id")
-        
-        # Skip if we've already seen this message
-        if last_seen_id and msg_id == last_seen_id:
-            break
-        if last_seen_id and int(msg_id) <= int(last_seen_id):
-            continue
-        
-        # Skip bot messages
-        author = msg.get("author", {})
-        if author.get("bot"):
-            print(f"[SKIP] bot message {msg_id}")
-            continue
-        
-        # Skip if user filtering enabled and user doesn't match
-        if allowed_user_id:
-            author_id = author.get("id")
-            if author_id != allowed_user_id:
-                print(f"[SKIP] unauthorized user {author_id} in message {msg_id}")
-                continue
-        
-        messages_to_process.append(msg)
-    
-    if not messages_to_process:
-        print("[INFO] No new messages to process")
-        return
-    
-    print(f"[INFO] Processing {len(messages_to_process)} new messages")
-    
-    # Process each message
-    last_ingested_id = None
-    for msg in messages_to_process:
-        msg_id = msg.get("id")
-        author = msg.get("author", {})
-        author_name = author.get("username", "unknown")
-        content = msg.get("content", "").strip()
-        ts = msg.get("timestamp")
-        
-        if not content:
-            print(f"[SKIP] empty content in message {msg_id}")
-            continue
-        
-        # POST to ingest endpoint
-        payload = {
-            "session_id": session_id,
-            "channel_id": channel_id,
-            "message_id": msg_id,
-            "author": author_name,
-            "content": content,
-            "ts": ts,
-        }
-        
-        print(f"[INGEST] message_id={msg_id} author={author_name}")
-        result = _post_ingest(base_url, payload)
-        
-        if result:
-            deduped = result.get("deduped", False)
-            queued = result.get("queued_reply", False)
-            if deduped:
-                print(f"[INFO] message_id={msg_id} was already ingested")
-            elif queued:
-                reply = result.get("reply_text", "")
-                print(f"[INFO] message_id={msg_id} reply queued: {reply[:60]}...")
-            else:
-                print(f"[INFO] message_id={msg_id} ingested (no reply)")
-            last_ingested_id = msg_id
-        else:
-            print(f"[ERROR] failed to ingest message_id={msg_id}")
-    
-    # Save last seen ID
-    if last_ingested_id:
-        _save_last_seen(state_file, last_ingested_id)
-        print(f"[OK] Saved last_seen_id={last_ingested_id}")
-    
-    print("[END] Discord poller complete")
+        handle(msg)
+
+    async def on_ready() -> None:
+        if last["id"] is not None:
+            await asyncio.to_thread(catch_up)
+
+    async def on_message(msg: dict) -> None:
+        # ingest waits on the agent; keep the heartbeat task running meanwhile
+        await asyncio.to_thread(handle, msg)
+
+    try:
+        asyncio.run(_run_gateway(bot_token, channel_id, on_message, on_ready))
+    except KeyboardInterrupt:
+        print("[END] Discord poller stopped")
 
 
 if __name__ == "__main__":
@@ -2,7 +2,8 @@
 """
 Discord Reply Sender - Sends agent replies back to Discord
 
-Polls the backend outbox and sends undelivered messages back to Discord.
+Follows the backend outbox stream and sends undelivered messages back to Discord.
+Sending only needs the REST API, so no Gateway connection is opened.
 
 Environment Variables:
   DISCORD_BOT_TOKEN (required): Discord bot token
@@ -16,13 +17,22 @@ Usage:
 
 import os
 import sys
+import json
 import time
 import logging
-import requests
 import asyncio
+import random
+from collections import OrderedDict
 from typing import Optional
 
-import discord
+import aiohttp
+
+# Optional faster event loop; plain asyncio is used when it is not installed
+try:
+    import uvloop
+    HAS_UVLOOP = True
+except ImportError:
+    HAS_UVLOOP = False
 
 # Configure logging
 logging.basicConfig(
@@ -41,6 +51,13 @@ def _env_or_error(key: str) -> str:
     return val
 
 
+DISCORD_API = "https://discord.com/api/v10"
+# Outbox messages read off the stream but not yet sent; put() waits when full
+OUTBOX_QUEUE_SIZE = 256
+# Ids of recently sent messages remembered to avoid sending one twice
+SENT_IDS_MAX = 1024
+
+
 class DiscordReplySender:
     """Polls backend outbox and sends replies to Discord."""
 
@@ -50,12 +67,27 @@ class DiscordReplySender:
         self.session_id = _env_or_error("SESSION_ID")
         self.channel_id = _env_or_error("DISCORD_CHANNEL_ID")
         
-        # Discord client for sending messages
-        intents = discord.Intents.default()
-        intents.message_content = False  # We only need to send messages
-        self.client = discord.Client(intents=intents)
-        
-        self.channel = None
+        # Sent only on discord.com requests, never to the backend
+        self._discord_headers = {
+            "Authorization": f"Bot {self.bot_token}",
+            "User-Agent": "DiscordBot (discord-reply-sender, 1.0)",
+        }
+        self._messages_url = f"{DISCORD_API}/channels/{self.channel_id}/messages"
+        # Backend outbox URLs, built once instead of on every request
+        self._outbox_url = f"{self.api_base_url}/sessions/{self.session_id}/outbox"
+        self._stream_url = f"{self._outbox_url}/stream"
+        self._bulk_url = f"{self._outbox_url}/bulk_deliver"
+
+        # Keep-alive session for backend and Discord calls; created in start()
+        # on the running event loop
+        self.http: Optional[aiohttp.ClientSession] = None
+        # delivery acks still in flight (see send_reply)
+        self._ack_tasks: set = set()
+        # stream reader -> sender worker handoff
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=OUTBOX_QUEUE_SIZE)
+        # recently sent ids, oldest first; a message replayed before its ack
+        # landed is skipped instead of posted again
+        self._sent_ids: "OrderedDict[str, None]" = OrderedDict()
 
     async def start(self):
         """Start the reply sender."""
@@ -64,90 +96,202 @@ class DiscordReplySender:
         logger.info(f"Session ID: {self.session_id}")
         logger.info(f"Channel ID: {self.channel_id}")
 
-        # Setup event handler
-        @self.client.event
-        async def on_ready():
-            """Called when bot connects."""
-            logger.info(f"Bot logged in as {self.client.user} (ID: {self.client.user.id})")
-            
-            # Get the channel
-            self.channel = self.client.get_channel(int(self.channel_id))
-            if not self.channel:
-                logger.error(f"Could not find channel {self.channel_id}")
-                await self.client.close()
+        self.http = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=8, keepalive_timeout=60),
+            timeout=aiohttp.ClientTimeout(total=10),
+        )
+        try:
+            # Check the channel is reachable before taking messages off the outbox
+            async with self.http.get(
+                f"{DISCORD_API}/channels/{self.channel_id}", headers=self._discord_headers
+            ) as response:
+                status = response.status
+                channel = await response.json() if status == 200 else None
+            if channel is None:
+                logger.error(f"Could not find channel {self.channel_id} (HTTP {status})")
                 return
-                
-            logger.info(f"Connected to channel: {self.channel.name}")
-            
-            # Start polling loop
-            await self.poll_outbox()
 
-        # Connect to Discord
-        await self.client.start(self.bot_token)
+            logger.info(f"Connected to channel: {channel.get('name')}")
+
+            # Read the outbox and send from it concurrently
+            await asyncio.gather(self.poll_outbox(), self._sender_worker())
+        finally:
+            await self._drain_acks()
+            await self.http.close()
 
     async def poll_outbox(self):
-        """Poll backend outbox and send replies."""
-        logger.info("Starting outbox polling loop...")
-        
+        """Follow the backend outbox stream and send replies.
+
+        The server pushes each message as it is queued, so there is no fixed
+        poll interval. While the stream is unavailable, falls back to one poll
+        per reconnect attempt with exponential backoff.
+        """
+        logger.info("Starting outbox stream...")
+        backoff = 1
+
         while True:
+            # a (re)connect replays undelivered rows; let queued sends and
+            # their acks land first so nothing is sent twice
+            await self._settle()
             try:
-                # Get undelivered messages from outbox
-                response = requests.get(
-                    f"{self.api_base_url}/sessions/{self.session_id}/outbox",
-                    timeout=10
-                )
+                await self._follow_outbox_stream()
+                # server closed the stream (e.g. restart); reconnect shortly,
+                # jittered so senders don't all reconnect in the same instant
+                backoff = 1
+                await asyncio.sleep(1 + random.random())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Outbox stream error: {e}; polling, retry in {backoff}s")
+                await self._settle()
+                await self._poll_outbox_once()
+                await asyncio.sleep(backoff + random.random())
+                backoff = min(backoff * 2, 60)
+
+    async def _follow_outbox_stream(self):
+        """Queue each message pushed on GET /outbox/stream until it closes."""
+        async with self.http.get(
+            self._stream_url,
+            # no overall deadline; the server sends a keepalive every 15s
+            timeout=aiohttp.ClientTimeout(total=None, sock_read=60),
+        ) as response:
+            if response.status != 200:
+                raise RuntimeError(f"HTTP {response.status}")
+            logger.info("✓ Connected to outbox stream")
+            async for line in response.content:
+                if line.startswith(b"data:"):
+                    msg = json.loads(line[5:])
+                    if not msg.get("delivered", False):
+                        await self.queue.put(msg)
+
+    async def _poll_outbox_once(self):
+        """Fetch pending outbox messages once and send them."""
+        try:
+            async with self.http.get(
+                self._outbox_url, params={"delivered": "false", "limit": "50"}
+            ) as response:
+                status = response.status
+                data = await response.json() if status == 200 else None
+            
+            if status == 200:
+                outbox = data.get("outbox", [])
                 
-                if response.status_code == 200:
-                    data = response.json()
-                    outbox = data.get("outbox", [])
-                    
-                    # Find undelivered messages
-                    undelivered = [msg for msg in outbox if not msg.get("delivered", False)]
+                # the backend filters already; also guards against one that ignores ?delivered
+                undelivered = [msg for msg in outbox if not msg.get("delivered", False)]
+                
+                if undelivered:
+                    logger.info(f"Found {len(undelivered)} undelivered messages")
                     
-                    if undelivered:
-                        logger.info(f"Found {len(undelivered)} undelivered messages")
+                    # send in order, then acknowledge them all in one call
+                    delivered = []
+                    for msg in undelivered:
+                        if await self._send_to_channel(msg):
+                            delivered.append(msg["id"])
+                    await self._ack_delivered(delivered)
                         
-                        for msg in undelivered:
-                            await self.send_reply(msg)
-                            
-                else:
-                    logger.error(f"Failed to get outbox: {response.status_code}")
-                
-                # Wait before next poll
-                await asyncio.sleep(3)
-                
-            except Exception as e:
-                logger.error(f"Error in polling loop: {e}")
-                await asyncio.sleep(5)
+            else:
+                logger.error(f"Failed to get outbox: {status}")
+            
+        except Exception as e:
+            logger.error(f"Error polling outbox: {e}")
 
     async def send_reply(self, msg: dict):
-        """Send a reply message to Discord."""
+        """Send a reply message to Discord and mark it delivered.
+
+        Sends stay sequential so replies keep their order in the channel; the
+        ack runs in the background, overlapping the next message's send.
+        """
+        if await self._send_to_channel(msg):
+            task = asyncio.create_task(self._ack_delivered([msg["id"]]))
+            self._ack_tasks.add(task)
+            task.add_done_callback(self._ack_tasks.discard)
+
+    async def _sender_worker(self):
+        """Send queued messages one at a time, in the order they were queued.
+
+        A single worker keeps channel order; the stream keeps being read while
+        a send is in flight.
+        """
+        while True:
+            msg = await self.queue.get()
+            try:
+                await self.send_reply(msg)
+            finally:
+                self.queue.task_done()
+
+    async def _drain_acks(self):
+        if self._ack_tasks:
+            await asyncio.gather(*self._ack_tasks, return_exceptions=True)
+
+    async def _settle(self):
+        """Wait until every queued message is sent and its ack has landed."""
+        await self.queue.join()
+        await self._drain_acks()
+
+    async def _send_to_channel(self, msg: dict) -> bool:
+        """Post an outbox message to the channel; True once Discord accepted it."""
+        if msg["id"] in self._sent_ids:
+            # posted before but not yet marked delivered (e.g. its ack failed):
+            # don't post again, but let the caller ack it again
+            logger.info(f"Already sent {msg['id']}, skipping post")
+            return True
         try:
             text = msg.get("text", "").strip()
             if not text:
                 logger.warning("Empty message, skipping")
-                return
+                return False
 
             logger.info(f"Sending reply: {text[:60]}...")
             
-            # Send message to Discord
-            discord_msg = await self.channel.send(text)
-            
-            # Mark as delivered in backend
-            response = requests.patch(
-                f"{self.api_base_url}/sessions/{self.session_id}/outbox/{msg['id']}",
-                json={"delivered": True, "delivered_at": discord_msg.created_at.isoformat()},
-                timeout=10
-            )
-            
-            if response.status_code == 200:
-                logger.info(f"✓ Reply sent and marked as delivered")
-            else:
-                logger.error(f"Failed to mark as delivered: {response.status_code}")
+            # Send message to Discord; retry after rate limits, which
+            # discord.py used to handle for us
+            for _ in range(5):
+                async with self.http.post(
+                    self._messages_url, json={"content": text}, headers=self._discord_headers
+                ) as response:
+                    status = response.status
+                    data = await response.json() if status == 429 else None
+                    body = await response.text() if status not in (200, 429) else ""
+                if status == 200:
+                    self._sent_ids[msg["id"]] = None
+                    if len(self._sent_ids) > SENT_IDS_MAX:
+                        self._sent_ids.popitem(last=False)
+                    return True
+                if status != 429:
+                    logger.error(f"Error sending reply: HTTP {status} {body[:200]}")
+                    return False
+                await asyncio.sleep(float(data.get("retry_after", 1)))
+            logger.error("Error sending reply: still rate limited")
+            return False
                 
         except Exception as e:
             logger.error(f"Error sending reply: {e}")
+            return False
+
+    async def _ack_delivered(self, ids: list):
+        """Mark sent messages delivered in the backend, in one request when it can."""
+        if not ids:
+            return
+        try:
+            async with self.http.post(self._bulk_url, json={"ids": ids}) as response:
+                status = response.status
+
+            if status in (404, 405):
+                # older backend without the bulk endpoint: overlap single PATCHes
+                statuses = await asyncio.gather(*(self._patch_delivered(f"{self._outbox_url}/{i}") for i in ids))
+                status = next((st for st in statuses if st != 200), 200)
+
+            if status == 200:
+                logger.info(f"✓ {len(ids)} reply(s) sent and marked as delivered")
+            else:
+                logger.error(f"Failed to mark as delivered: {status}")
+
+        except Exception as e:
+            logger.error(f"Error marking delivered: {e}")
 
+    async def _patch_delivered(self, url: str) -> int:
+        async with self.http.patch(url, json={"delivered": True}) as response:
+            return response.status
 
 async def main():
     """Initialize and run the reply sender."""
@@ -157,7 +301,10 @@ async def main():
 
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        if HAS_UVLOOP:
+            uvloop.run(main())
+        else:
+            asyncio.run(main())
     except KeyboardInterrupt:
         logger.info("Shutting down...")
     except Exception as e:
@@ -5,7 +5,8 @@
 # Usage:
 #   powershell -ExecutionPolicy Bypass -File scripts/run_discord_poller.ps1
 #
-# Or schedule via Windows Task Scheduler /TR:
+# The poller stays connected to the Discord Gateway until stopped, so schedule
+# it to start at logon (not on a repeating trigger) via Windows Task Scheduler /TR:
 #   powershell -ExecutionPolicy Bypass -File C:\path\to\scripts\run_discord_poller.ps1
 
 param(
@@ -13,8 +14,7 @@ param(
     [string]$ChannelId = $env:DISCORD_CHANNEL_ID,
     [string]$SessionId = $env:SESSION_ID,
     [string]$BaseUrl = $env:BASE_URL,
-    [string]$AllowedUserId = $env:DISCORD_ALLOWED_USER_ID,
-    [string]$StateFile = $env:STATE_FILE
+    [string]$AllowedUserId = $env:DISCORD_ALLOWED_USER_ID
 )
 
 # Validate required env vars
@@ -35,9 +35,6 @@ if (-not $SessionId) {
 if (-not $BaseUrl) {
     $BaseUrl = "http://127.0.0.1:8000"
 }
-if (-not $StateFile) {
-    $StateFile = ".discord_last_seen.json"
-}
 
 # Set environment for subprocess
 $env:DISCORD_BOT_TOKEN = $BotToken
@@ -47,13 +44,11 @@ $env:BASE_URL = $BaseUrl
 if ($AllowedUserId) {
     $env:DISCORD_ALLOWED_USER_ID = $AllowedUserId
 }
-$env:STATE_FILE = $StateFile
 
 Write-Host "[INFO] Running Discord poller..."
 Write-Host "  DISCORD_CHANNEL_ID: $ChannelId"
 Write-Host "  SESSION_ID: $SessionId"
 Write-Host "  BASE_URL: $BaseUrl"
-Write-Host "  STATE_FILE: $StateFile"
 
 # Run the poller
 python scripts/discord_poller.py
@@ -63,5 +58,5 @@ if ($LASTEXITCODE -ne 0) {
     exit $LASTEXITCODE
 }
 
-Write-Host "[OK] Discord poller completed"
+Write-Host "[OK] Discord poller stopped"
 exit 0
@@ -8,7 +8,7 @@ endpoint can be exercised.
 
 Run from the repository root after starting the server (uvicorn):
 
-        python -m pip install requests
+        python -m pip install requests orjson
         uvicorn app.main:app --reload --port 8000
         python scripts/seed_personal_state.py
 
@@ -18,24 +18,32 @@ Simulation profile (how it mimics a real day):
 - 1 check-in: mood/energy/focus + note — simulates a recent user status update.
 """
 
+from concurrent.futures import ThreadPoolExecutor
+
+import orjson
 import requests
 from datetime import datetime, timedelta, timezone
 
 
 BASE = "http://127.0.0.1:8000"
+URL_CHAT = f"{BASE}/chat"
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+# Reused for every call so the seed run keeps one keep-alive connection
+SESSION = requests.Session()
 
 
 def post_chat(message: str, session_id: str | None = None):
     payload = {"message": message}
     if session_id:
         payload["session_id"] = session_id
-    r = requests.post(f"{BASE}/chat", json=payload)
+    r = SESSION.post(URL_CHAT, data=orjson.dumps(payload), headers=JSON_HEADERS)
     r.raise_for_status()
     return r.json()
 
 
 def get_json(path: str):
-    r = requests.get(f"{BASE}{path}")
+    r = SESSION.get(f"{BASE}{path}")
     r.raise_for_status()
     return r.json()
 
@@ -47,15 +55,15 @@ def main():
     session_id = res.get("session_id")
     print("session_id:", session_id)
 
-    # 2) add 3 tasks
-    post_chat("add task Buy groceries", session_id=session_id)
-    post_chat("add task Walk the dog", session_id=session_id)
-    post_chat("add task Finish report", session_id=session_id)
+    # 2) add 3 tasks; they are independent, so send them concurrently
+    titles = ["Buy groceries", "Walk the dog", "Finish report"]
+    with ThreadPoolExecutor(len(titles)) as ex:
+        list(ex.map(lambda t: post_chat(f"add task {t}", session_id=session_id), titles))
 
-    # get tasks and complete one
+    # get tasks and complete one; picked by title since the adds may land in any order
     tasks = get_json(f"/sessions/{session_id}/tasks").get("tasks", [])
-    if tasks:
-        first_id = tasks[0]["id"]
+    first_id = next((t["id"] for t in tasks if t["title"] == titles[0]), None)
+    if first_id:
         post_chat(f"complete {first_id}", session_id=session_id)
 
     # 3) add 2 reminders (one overdue, one future)
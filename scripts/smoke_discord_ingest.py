@@ -14,19 +14,27 @@ Usage:
 
 import json
 import sys
-import urllib.request
-import urllib.error
 import os
 from datetime import datetime, timezone
 
+from concurrent.futures import ThreadPoolExecutor
+
+import orjson
+import urllib3
+
 BASE_URL = os.getenv("BASE_URL", "http://127.0.0.1:8000").rstrip("/")
 SESSION_ID = "test-discord-session-" + str(datetime.now(timezone.utc).timestamp())
 CHANNEL_ID = "test-channel-123"
+URL_INGEST = f"{BASE_URL}/integrations/discord/ingest"
+URL_OUTBOX = f"{BASE_URL}/sessions/{SESSION_ID}/outbox"
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+# One keep-alive connection to the backend for all of the test's calls
+HTTP = urllib3.PoolManager(num_pools=1, maxsize=4)
 
 
 def post_ingest(message_id: str, author: str, content: str) -> dict | None:
     """POST to /integrations/discord/ingest"""
-    url = f"{BASE_URL}/integrations/discord/ingest"
     payload = {
         "session_id": SESSION_ID,
         "channel_id": CHANNEL_ID,
@@ -35,14 +43,12 @@ def post_ingest(message_id: str, author: str, content: str) -> dict | None:
         "content": content,
     }
     
-    headers = {"Content-Type": "application/json"}
-    data = json.dumps(payload).encode("utf-8")
-    
     try:
-        req = urllib.request.Request(url, data=data, headers=headers, method="POST")
-        with urllib.request.urlopen(req, timeout=10) as response:
-            result = response.read().decode("utf-8")
-            return json.loads(result)
+        response = HTTP.request("POST", URL_INGEST, body=orjson.dumps(payload), headers=JSON_HEADERS, timeout=10)
+        if response.status >= 400:
+            print(f"[ERROR] POST failed: HTTP {response.status} {response.reason}", file=sys.stderr)
+            return None
+        return orjson.loads(response.data)
     except Exception as e:
         print(f"[ERROR] POST failed: {e}", file=sys.stderr)
         return None
@@ -50,12 +56,12 @@ def post_ingest(message_id: str, author: str, content: str) -> dict | None:
 
 def get_outbox() -> list:
     """GET /sessions/{session_id}/outbox"""
-    url = f"{BASE_URL}/sessions/{SESSION_ID}/outbox"
     try:
-        with urllib.request.urlopen(url, timeout=10) as response:
-            result = response.read().decode("utf-8")
-            data = json.loads(result)
-            return data.get("outbox", [])
+        response = HTTP.request("GET", URL_OUTBOX, timeout=10)
+        if response.status >= 400:
+            print(f"[ERROR] GET outbox failed: HTTP {response.status} {response.reason}", file=sys.stderr)
+            return []
+        return orjson.loads(response.data).get("outbox", [])
     except Exception as e:
         print(f"[ERROR] GET outbox failed: {e}", file=sys.stderr)
         return []
@@ -66,6 +72,13 @@ def main():
     print(f"[TEST] Session: {SESSION_ID}")
     print(f"[TEST] Base URL: {BASE_URL}\n")
     
+    # Test 3's message is independent of tests 1 and 2, so its ingest (and the
+    # agent reply it waits on) runs alongside them; results print in test order.
+    # Test 2 needs test 1's message stored first, so it stays serial.
+    ex = ThreadPoolExecutor(max_workers=1)
+    msg_id_2 = "msg-456-second"
+    future3 = ex.submit(post_ingest, msg_id_2, "bob", "This is a different message.")
+    
     # Test 1: First ingest (no dedup)
     print("=" * 60)
     print("TEST 1: First ingest (should NOT be deduped)")
@@ -108,8 +121,12 @@ def main():
     print("TEST 3: Different message (should NOT be deduped)")
     print("=" * 60)
     
-    msg_id_2 = "msg-456-second"
-    result3 = post_ingest(msg_id_2, "bob", "This is a different message.")
+    result3 = future3.result()
+    ex.shutdown()
+    
+    if not result3:
+        print("[FAIL] No response from endpoint", file=sys.stderr)
+        sys.exit(1)
     
     print(f"Response: {json.dumps(result3, indent=2)}")
     
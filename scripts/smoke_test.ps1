@@ -13,26 +13,40 @@ from pathlib import Path
 ROOT = Path(__file__).resolve().parents[1]
 sys.path.insert(0, str(ROOT))
 
+import asyncio
 import uuid
 from datetime import datetime, timezone
 
-from app.agent import handle_message
+from app.agent import handle_message as _handle_message
 from app import memory
 
 
+def handle_message(text, session_id):
+    return asyncio.run(_handle_message(text, session_id))
+
+
 def now_iso():
     return datetime.now(timezone.utc).isoformat()
 
 
-def get_attr(obj, key):
-    return obj.get(key) if isinstance(obj, dict) else getattr(obj, key)
+def parse_ts(ts):
+    # the DB store returns naive UTC timestamps
+    dt = datetime.fromisoformat(ts)
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+
+def _resolve_accessor(sample):
+    # rows from one store share a shape, so pick the field getter once per
+    # row/list instead of type-checking on every read
+    return dict.get if isinstance(sample, dict) else getattr
 
 
-def find_reminder_by_text(reminders, text):
-    for r in reminders:
-        if get_attr(r, "text") == text:
-            return r
-    return None
+def index_by(rows, key):
+    # one pass to build, then O(1) lookups by that field
+    if not rows:
+        return {}
+    get = _resolve_accessor(rows[0])
+    return {get(r, key): r for r in rows}
 
 
 def run_tests():
@@ -46,30 +60,29 @@ def run_tests():
         if not isinstance(resp, str):
             failures.append((msg, f"handle_message returned non-str: {type(resp)}"))
         rems = store.list_reminders(sid)
-        r = find_reminder_by_text(rems, expected_text)
-        return r
+        return index_by(rems, "text").get(expected_text)
 
     # 1) timed reminder 15 minutes
     inp = "remind me in 15 minutes to buy milk"
     r = create_reminder(inp, "buy milk")
+    now = datetime.now(timezone.utc)
     if not r:
         failures.append((inp, "reminder not created"))
     else:
-        due_ts = get_attr(r, "due_ts")
-        due = datetime.fromisoformat(due_ts)
-        delta_min = (due - datetime.now(timezone.utc)).total_seconds() / 60.0
+        due = parse_ts(_resolve_accessor(r)(r, "due_ts"))
+        delta_min = (due - now).total_seconds() / 60.0
         if not (13 <= delta_min <= 17):
             failures.append((inp, f"due delta minutes={delta_min:.2f} not ~15"))
 
     # 2) negative minutes overdue
     inp = "remind me in -5 minutes to test overdue"
     r = create_reminder(inp, "test overdue")
+    now = datetime.now(timezone.utc)
     if not r:
         failures.append((inp, "reminder not created"))
     else:
-        due_ts = get_attr(r, "due_ts")
-        due = datetime.fromisoformat(due_ts)
-        if not (due < datetime.now(timezone.utc)):
+        due = parse_ts(_resolve_accessor(r)(r, "due_ts"))
+        if not (due < now):
             failures.append((inp, "due time not in past"))
 
     # 3) untimed reminder
@@ -84,32 +97,30 @@ def run_tests():
     if not seed_rem:
         failures.append((seed_msg, "seed reminder not created"))
     else:
-        rid = get_attr(seed_rem, "id")
+        get = _resolve_accessor(seed_rem)
+        rid = get(seed_rem, "id")
         inp = f"complete reminder {rid}"
         handle_message(inp, sid)
         rems = store.list_reminders(sid)
-        updated = None
-        for rr in rems:
-            if get_attr(rr, "id") == rid:
-                updated = rr
-                break
-        if not updated or not get_attr(updated, "completed"):
+        updated = index_by(rems, "id").get(rid)
+        if not updated or not get(updated, "completed"):
             failures.append((inp, "reminder not marked completed"))
 
     # 5) complete task <id> (use real created task id)
     task_msg = "add task smoke task"
     handle_message(task_msg, sid)
     tasks = store.list_tasks(sid)
-    task = next((t for t in tasks if get_attr(t, "title") == "smoke task"), None)
+    task = index_by(tasks, "title").get("smoke task")
     if not task:
         failures.append((task_msg, "task not created"))
     else:
-        tid = get_attr(task, "id")
+        get = _resolve_accessor(task)
+        tid = get(task, "id")
         inp = f"complete {tid}"
         handle_message(inp, sid)
         tasks2 = store.list_tasks(sid)
-        updated_t = next((t for t in tasks2 if get_attr(t, "id") == tid), None)
-        if not updated_t or not get_attr(updated_t, "completed"):
+        updated_t = index_by(tasks2, "id").get(tid)
+        if not updated_t or not get(updated_t, "completed"):
             failures.append((inp, "task not marked completed"))
 
     # 6) extra spacing